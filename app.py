@@ -1,22 +1,161 @@
 import os
 import customtkinter as ctk
 from tkinter import filedialog, messagebox, Toplevel, Label, PhotoImage
-from PIL import Image, ImageTk, ImageOps
+from PIL import Image, ImageTk, ImageOps, ImageDraw
 from pathlib import Path 
 from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import winsound
 import shutil
 import threading
+import json
+import sqlite3
 import pyrebase
 import logging
 import queue
+import random
+import time
+import requests
+from staging_engine import (
+    STATION_ID, fileErrors, retryable_transfers, machine_registry, load_machine_registry, set_machine_registry,
+    is_machine_enabled, assign_files, clean_machines, start_copying_files, start_transfer_telemetry,
+    telemetry_lock, sample_transfer_telemetry, describe_machine_telemetry, describe_run_telemetry,
+    export_transfer_telemetry,
+)
 
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, filename='app_debug.log', filemode='a',
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# ---- Machine registry: loaded by the staging engine from machines.json ----
+
+# The UI can't work without a floor, so a missing registry file is an error here
+if not machine_registry:
+    set_machine_registry(load_machine_registry())
+
+# Function to arrange the registry into grid rows of (machine_num, column), top row first
+def build_layout(registry):
+    rows = {}
+    for machine in registry.values():
+        rows.setdefault(machine["row"], []).append((machine["number"], machine["column"]))
+    return [sorted(rows[row], key=lambda machine_info: machine_info[1]) for row in sorted(rows)]
+
+# ---- Machine images: resized and grayscale variants cached in a single atlas ----
+
+desired_width = 50
+desired_height = 50
+IMAGE_CACHE_DIR = Path("image_cache")
+ATLAS_IMAGE_PATH = IMAGE_CACHE_DIR / "machine_atlas.png"
+ATLAS_INDEX_PATH = IMAGE_CACHE_DIR / "machine_atlas.json"
+ATLAS_VARIANTS = ("normal", "selected", "disabled")  # One atlas column per variant
+
+# Function to list the source images for every machine
+def get_machine_image_sources():
+    return {
+        i: (f"images/unselected/image-m-{i}.png", f"images/selected/image-m-{i}-selected.png")
+        for i in sorted(machine_registry)
+    }
+
+# Function to draw a plain numbered tile for a machine that has no artwork of its own
+def render_generic_machine_image(machine_num, selected):
+    image = Image.new("RGBA", (desired_width, desired_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    fill = (31, 106, 165, 255) if selected else (90, 90, 90, 255)
+    draw.rounded_rectangle((1, 1, desired_width - 2, desired_height - 2), radius=8, fill=fill)
+    text = str(machine_num)
+    left, top, right, bottom = draw.textbbox((0, 0), text)
+    draw.text(((desired_width - (right - left)) / 2 - left, (desired_height - (bottom - top)) / 2 - top),
+              text, fill=(255, 255, 255, 255))
+    return image
+
+# Function to describe the sources an atlas was built from, used to tell when it's stale
+def get_atlas_signature(sources):
+    signature = {"size": [desired_width, desired_height], "sources": {}}
+    for i, paths in sources.items():
+        for path in paths:
+            try:
+                signature["sources"][path] = os.stat(path).st_mtime_ns
+            except OSError:
+                signature["sources"][path] = None
+    return signature
+
+# Function to resize every source image once and save the variants as a sprite atlas
+def build_machine_image_atlas(sources):
+    sprites = {}
+    for i, (unselected_image_path, selected_image_path) in sources.items():
+        # Load and resize unselected image
+        try:
+            normal_image = Image.open(unselected_image_path).resize((desired_width, desired_height))
+        except Exception as e:
+            logging.debug(f"No unselected image for machine {i}, using a generic tile: {e}")
+            normal_image = render_generic_machine_image(i, selected=False)
+
+        # Load and resize selected image
+        try:
+            selected_image = Image.open(selected_image_path).resize((desired_width, desired_height))
+        except Exception as e:
+            logging.debug(f"No selected image for machine {i}, using a generic tile: {e}")
+            selected_image = render_generic_machine_image(i, selected=True)
+
+        # Grayscale copy to indicate a disabled machine
+        disabled_image = ImageOps.grayscale(normal_image)
+        sprites[i] = {
+            'normal': normal_image.convert("RGBA"),
+            'selected': selected_image.convert("RGBA"),
+            'disabled': disabled_image.convert("RGBA"),
+        }
+
+    atlas = Image.new("RGBA", (desired_width * len(ATLAS_VARIANTS), desired_height * len(sources)))
+    rows = {}
+    for row, (i, variants) in enumerate(sorted(sprites.items())):
+        rows[str(i)] = row
+        for column, variant in enumerate(ATLAS_VARIANTS):
+            atlas.paste(variants[variant], (column * desired_width, row * desired_height))
+
+    try:
+        IMAGE_CACHE_DIR.mkdir(exist_ok=True)
+        atlas.save(ATLAS_IMAGE_PATH)
+        with open(ATLAS_INDEX_PATH, "w", encoding="utf-8") as f:
+            json.dump({"signature": get_atlas_signature(sources), "rows": rows}, f)
+    except OSError as e:
+        logging.warning(f"Could not save machine image atlas: {e}")
+    return sprites
+
+# Function to cut the machine sprites out of a cached atlas, or None if it's missing or stale
+def load_machine_image_atlas(sources):
+    try:
+        with open(ATLAS_INDEX_PATH, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index["signature"] != get_atlas_signature(sources):
+            return None
+        atlas = Image.open(ATLAS_IMAGE_PATH)
+        atlas.load()
+    except (OSError, ValueError, KeyError):
+        return None
+
+    sprites = {}
+    for i, row in index["rows"].items():
+        top = row * desired_height
+        sprites[int(i)] = {
+            variant: atlas.crop((column * desired_width, top, (column + 1) * desired_width, top + desired_height))
+            for column, variant in enumerate(ATLAS_VARIANTS)
+        }
+    return sprites
+
+# Function to get the machine sprites, rebuilding the atlas when a source image has changed
+def load_machine_sprites():
+    sources = get_machine_image_sources()
+    sprites = load_machine_image_atlas(sources)
+    if sprites is None:
+        logging.info("Machine image atlas missing or stale; rebuilding it.")
+        sprites = build_machine_image_atlas(sources)
+    return sprites
+
+# Decode the sprites in the background while the window and Firebase connection are set up
+image_loader = ThreadPoolExecutor(max_workers=1)
+machine_image_future = image_loader.submit(load_machine_sprites)
+
 # Initialize the customtkinter appearance
 ctk.set_appearance_mode("dark")  # Modes: "System" (default), "Dark", "Light"
 ctk.set_default_color_theme("dark-blue")  # Themes: "blue" (default), "green", "dark-blue")
@@ -49,21 +188,90 @@ fireConfig = {
     "storageBucket": os.getenv("STORAGE_BUCKET"),
 }
 
-# Initialize Firebase
-firebase = pyrebase.initialize_app(fireConfig)
-db = firebase.database()
+# Firebase is connected in the background (see connect_to_firebase) so the window shows at once
+firebase = None
+db = None
+firebase_ready = threading.Event()     # Set once db is usable
+firebase_sync_status = "connecting"    # connecting -> syncing -> live; offline/reconnecting while retrying
+FIREBASE_CONNECT_RETRY_DELAY = 5       # Seconds between connection attempts while offline
+MACHINE_STATE_STORE_FILE = Path("machine_states.db")  # Local durable copy of machine_states
 
 # Function to initialize machine_states in Firebase as a dictionary
 def initialize_machine_states_in_firebase():
     existing_data = db.child('machine_states').get().val()
     if existing_data is None or isinstance(existing_data, list):
         # Initialize machine_states as a dictionary
-        total_machines = 30  # Adjust this number as needed
-        initial_states = {str(i): 0 for i in range(1, total_machines + 1)}
+        initial_states = {str(i): 0 for i in machine_registry}
         db.child('machine_states').set(initial_states)
 
-# Call the initialization function
-initialize_machine_states_in_firebase()
+# ---- Local machine state store ----
+# Every state is kept in SQLite so the app can start, read and change states without Firebase.
+# Rows changed locally stay marked unsynced until the writer has confirmed them in Firebase;
+# those changes are replayed on the next connection and win over older remote snapshots.
+
+machine_state_store = sqlite3.connect(MACHINE_STATE_STORE_FILE, check_same_thread=False)
+machine_state_store.execute("PRAGMA journal_mode=WAL")
+machine_state_store.execute("PRAGMA synchronous=NORMAL")
+machine_state_store.execute(
+    "CREATE TABLE IF NOT EXISTS machine_states ("
+    "machine TEXT PRIMARY KEY, state INTEGER NOT NULL, synced INTEGER NOT NULL, updated REAL NOT NULL)"
+)
+machine_state_store.commit()
+machine_state_store_lock = threading.Lock()
+
+# In-memory copies of the store so lookups never touch the disk or the network
+cached_machine_states = {}   # machine key -> state
+unsynced_machine_states = {}  # machine key -> state not yet confirmed by Firebase
+
+with machine_state_store_lock:
+    for machine_key, state, synced in machine_state_store.execute("SELECT machine, state, synced FROM machine_states"):
+        cached_machine_states[machine_key] = state
+        if not synced:
+            unsynced_machine_states[machine_key] = state
+
+# Function to record machine states locally in one transaction; synced=False marks changes Firebase hasn't seen yet
+def store_machine_states(states, synced):
+    now = time.time()
+    with machine_state_store_lock:
+        for machine_num, state in states.items():
+            key = str(machine_num)
+            cached_machine_states[key] = state
+            if synced:
+                unsynced_machine_states.pop(key, None)
+            else:
+                unsynced_machine_states[key] = state
+        try:
+            machine_state_store.executemany(
+                "INSERT OR REPLACE INTO machine_states (machine, state, synced, updated) VALUES (?, ?, ?, ?)",
+                [(str(machine_num), state, int(synced), now) for machine_num, state in states.items()]
+            )
+            machine_state_store.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error saving machine states {states} locally: {e}")
+
+# Function to record one machine's state locally
+def store_machine_state(machine_num, state, synced):
+    store_machine_states({machine_num: state}, synced)
+
+# Function to mark a written batch as synced, unless a machine has changed again since
+def mark_machine_states_synced(batch):
+    with machine_state_store_lock:
+        for key, state in batch.items():
+            if unsynced_machine_states.get(key) == state:
+                del unsynced_machine_states[key]
+        try:
+            machine_state_store.executemany(
+                "UPDATE machine_states SET synced = 1 WHERE machine = ? AND state = ?",
+                [(key, state) for key, state in batch.items()]
+            )
+            machine_state_store.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error marking machine states {batch} as synced: {e}")
+
+# Function to check whether a machine has a local change Firebase hasn't confirmed yet
+def has_unsynced_state(machine_num):
+    with machine_state_store_lock:
+        return str(machine_num) in unsynced_machine_states
 
 # Frame 1 - Machine Selection
 frame1 = ctk.CTkFrame(app, width=500, height=700)
@@ -98,12 +306,13 @@ available_checkbox.grid(row=5, column=2, sticky="w", pady=5)
 
 # Function to toggle check/uncheck all machines
 def toggle_all_machines():
-    # Check if all machines are selected
-    all_selected = all(machine_states[machine_num].get() == 1 for machine_num in range(1, 10))
+    # Check if all enabled machines are selected
+    enabled_machines = [machine_num for machine_num in machine_registry if is_machine_enabled(machine_num)]
+    all_selected = all(machine_states[machine_num].get() == 1 for machine_num in enabled_machines)
     
     # Toggle based on current state
     new_state = 0 if all_selected else 1  # Set to 0 if all selected, otherwise set to 1
-    for machine_num in range(1, 10):
+    for machine_num in enabled_machines:
         machine_states[machine_num].set(new_state)  # Set each machine to new state
         update_image_funcs[machine_num]()           # Update the image
 
@@ -121,54 +330,26 @@ label1 = ctk.CTkLabel(frame1, text="Select Machines to Stage", font=("Arial", 20
 label1.grid(row=7, column=1, columnspan=2, pady=2)
 
 machine_images = {}
-desired_width = 50
-desired_height = 50
 
-for i in range(1, 31):
-    unselected_image_path = f"images/unselected/image-m-{i}.png"
-    selected_image_path = f"images/selected/image-m-{i}-selected.png"
+# Build the CTkImages from the atlas sprites decoded in the background
+for i, sprites in machine_image_future.result().items():
+    normal_ctk_image = ctk.CTkImage(light_image=sprites['normal'], dark_image=sprites['normal'],
+                                    size=(desired_width, desired_height))
+    selected_ctk_image = ctk.CTkImage(light_image=sprites['selected'], dark_image=sprites['selected'],
+                                      size=(desired_width, desired_height))
 
-    # Load and resize unselected image
-    try:
-        normal_image = Image.open(unselected_image_path).resize((desired_width, desired_height))
-        normal_ctk_image = ctk.CTkImage(light_image=normal_image, dark_image=normal_image,
-                                        size=(desired_width, desired_height))
-    except Exception as e:
-        print(f"Error loading unselected image for machine {i}: {e}")
-        continue  # Skip to the next iteration
-
-    # Load and resize selected image
-    try:
-        selected_image = Image.open(selected_image_path).resize((desired_width, desired_height))
-        selected_ctk_image = ctk.CTkImage(light_image=selected_image, dark_image=selected_image,
-                                          size=(desired_width, desired_height))
-    except Exception as e:
-        print(f"Error loading selected image for machine {i}: {e}")
-        continue  # Skip to the next iteration
-
-    # For disabled machines, create a grayed-out image
-    if i >= 10:
-        # Convert to grayscale to indicate disabled
-        disabled_image = ImageOps.grayscale(normal_image)
-        disabled_ctk_image = ctk.CTkImage(light_image=disabled_image, dark_image=disabled_image,
+    # For disabled machines, use the grayed-out image
+    if not is_machine_enabled(i):
+        disabled_ctk_image = ctk.CTkImage(light_image=sprites['disabled'], dark_image=sprites['disabled'],
                                           size=(desired_width, desired_height))
         machine_images[i] = {'normal': disabled_ctk_image, 'selected': disabled_ctk_image}
     else:
         # Store images in dictionary
         machine_images[i] = {'normal': normal_ctk_image, 'selected': selected_ctk_image}
 
-# Layout as per your specified format
-layout = [
-    [(9, 0), (22, 3)],
-    [(8, 0), (23, 3)],
-    [(7, 0), (10, 1), (21, 2), (24, 3)],
-    [(6, 0), (11, 1), (20, 2), (25, 3)],
-    [(5, 0), (12, 1), (19, 2), (26, 3)],
-    [(4, 0), (13, 1), (18, 2), (27, 3)],
-    [(3, 0), (14, 1), (17, 2), (28, 3)],
-    [(2, 0), (15, 1), (16, 2), (29, 3)],
-    [(1, 0), (30, 3)],
-]
+# Layout built from the machine registry: rows of (machine_num, column)
+layout = build_layout(machine_registry)
+layout_columns = max(machine["column"] for machine in machine_registry.values()) + 1
 
 # Variables to hold the state of the checkboxes (selected/unselected)
 machine_states = {}          # Dictionary to store IntVars
@@ -176,72 +357,466 @@ machine_states_traces = {}   # Dictionary to store trace IDs
 machine_labels = {}          # Dictionary to store image labels
 update_image_funcs = {}      # Dictionary to store update functions
 
+# Firebase writer settings
+FIREBASE_WRITE_QUEUE_SIZE = 32     # Batches waiting for the writer before the UI holds changes back
+FIREBASE_RETRY_BASE_DELAY = 0.5    # Seconds before the first retry of a failed write
+FIREBASE_RETRY_MAX_DELAY = 30      # Upper bound for the retry backoff in seconds
+FIREBASE_SLOW_WRITE_MS = 500       # Writes slower than this are logged as a warning
+
+# Machine state writes made during the current UI tick, keyed by machine number
+pending_state_writes = {}
+applying_remote_states = False  # True while remote changes are applied to the IntVars
+state_flush_scheduled = False
+firebase_write_queue = queue.Queue(maxsize=FIREBASE_WRITE_QUEUE_SIZE)  # Batches of {machine_num: state}
+
+# Writer statistics shown under the machine grid
+firebase_writer_stats = {
+    "in_flight": 0,          # Keys in the batch currently being written
+    "writes": 0,             # Successful update() calls
+    "retries": 0,            # Failed attempts that were retried
+    "superseded": 0,         # Writes dropped because a newer state for the same machine arrived
+    "last_latency_ms": None,
+    "avg_latency_ms": None,
+}
+firebase_writer_lock = threading.Lock()
+
 # Function to handle state changes and update Firebase
 def on_machine_state_change(machine_num, *args):
-    state = machine_states[machine_num].get()
-    db.child('machine_states').child(machine_num).set(state)
-
-# Function to update local machine state from Firebase
-def update_local_machine_state(machine_num, state):
-    def update_state():
-        # Temporarily remove the trace to prevent recursion
-        machine_states[machine_num].trace_vdelete('w', machine_states_traces[machine_num])
-        # Update the IntVar
-        machine_states[machine_num].set(state)
-        # Update the image
-        update_image_funcs[machine_num]()
-        # Re-establish the trace
-        trace_id = machine_states[machine_num].trace('w', lambda *args, mn=machine_num: on_machine_state_change(mn, *args))
-        machine_states_traces[machine_num] = trace_id
+    global state_flush_scheduled
+    if applying_remote_states:
+        return  # The change came from Firebase, so there's nothing to write back
+    key = str(machine_num)
+    if key in pending_state_writes:
+        with firebase_writer_lock:
+            firebase_writer_stats["superseded"] += 1
+    pending_state_writes[key] = machine_states[machine_num].get()
+    store_machine_state(machine_num, pending_state_writes[key], synced=False)
+    # Coalesce every change made in this tick (e.g. "Check All") into one flush
+    if not state_flush_scheduled:
+        state_flush_scheduled = True
+        app.after_idle(flush_machine_state_writes)
+
+# Function to hand the coalesced state changes to the Firebase writer thread
+def flush_machine_state_writes():
+    global state_flush_scheduled
+    state_flush_scheduled = False
+    if not pending_state_writes:
+        return
+    try:
+        firebase_write_queue.put_nowait(dict(pending_state_writes))
+        pending_state_writes.clear()
+    except queue.Full:
+        # Backpressure: keep the changes here (newer states keep replacing older ones)
+        # and try again shortly instead of blocking the UI
+        logging.warning(f"Firebase write queue is full; holding {len(pending_state_writes)} change(s).")
+        state_flush_scheduled = True
+        app.after(100, flush_machine_state_writes)
+
+# Function to merge every queued batch into one, later states winning
+def merge_queued_state_writes(batch):
+    """
+    Returns the merged batch and how many queued batches it absorbed, so the writer can mark
+    each of them done once the merged write has landed.
+    """
+    taken = 0
+    while True:
+        try:
+            newer = firebase_write_queue.get_nowait()
+        except queue.Empty:
+            return batch, taken
+        taken += 1
+        superseded = len(batch.keys() & newer.keys())
+        if superseded:
+            with firebase_writer_lock:
+                firebase_writer_stats["superseded"] += superseded
+        batch.update(newer)
+
+# Function to record the latency of a successful write
+def record_firebase_write(latency_ms):
+    with firebase_writer_lock:
+        stats = firebase_writer_stats
+        stats["writes"] += 1
+        stats["last_latency_ms"] = latency_ms
+        if stats["avg_latency_ms"] is None:
+            stats["avg_latency_ms"] = latency_ms
+        else:
+            # Exponential moving average so one slow write doesn't dominate the display
+            stats["avg_latency_ms"] = 0.8 * stats["avg_latency_ms"] + 0.2 * latency_ms
+    if latency_ms > FIREBASE_SLOW_WRITE_MS:
+        logging.warning(f"Slow Firebase write: {latency_ms:.0f} ms.")
+
+# Background worker that sends each batch as a single multi-path update
+def firebase_writer():
+    while True:
+        batch, taken = merge_queued_state_writes(firebase_write_queue.get())
+        taken += 1
+        # Changes made before the connection is up wait here; the UI keeps working meanwhile
+        firebase_ready.wait()
+        attempt = 0
+        while True:
+            firebase_writer_stats["in_flight"] = len(batch)
+            start = time.perf_counter()
+            try:
+                db.child('machine_states').update(batch)
+            except Exception as e:
+                attempt += 1
+                delay = min(FIREBASE_RETRY_MAX_DELAY, FIREBASE_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+                delay = random.uniform(delay / 2, delay)  # Jitter so stations don't retry in lockstep
+                with firebase_writer_lock:
+                    firebase_writer_stats["retries"] += 1
+                logging.error(f"Error writing machine states {batch} to Firebase (attempt {attempt}), "
+                              f"retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                # Anything queued while waiting replaces the stale states in this batch
+                batch, newer_taken = merge_queued_state_writes(batch)
+                taken += newer_taken
+                continue
+            latency_ms = (time.perf_counter() - start) * 1000
+            mark_machine_states_synced(batch)
+            record_firebase_write(latency_ms)
+            logging.debug(f"Wrote {len(batch)} machine state(s) to Firebase in {latency_ms:.0f} ms.")
+            break
+        firebase_writer_stats["in_flight"] = 0
+        for _ in range(taken):
+            firebase_write_queue.task_done()
+
+writer_thread = threading.Thread(target=firebase_writer)
+writer_thread.daemon = True
+writer_thread.start()
+
+# Replay changes that never reached Firebase before the app was last closed
+if unsynced_machine_states:
+    logging.info(f"Replaying {len(unsynced_machine_states)} unsynced machine state(s) to Firebase.")
+    firebase_write_queue.put_nowait(dict(unsynced_machine_states))
+
+# Remote changes waiting for the main thread, keyed by machine number
+pending_remote_states = {}
+pending_remote_states_lock = threading.Lock()
+remote_apply_scheduled = False
+
+# Function to queue the remote states that differ from what is shown for one main-thread update
+def update_local_machine_states(incoming):
+    global remote_apply_scheduled
+    with pending_remote_states_lock:
+        with machine_state_store_lock:
+            changes = {}
+            for machine_num, state in incoming.items():
+                key = str(machine_num)
+                # A local change that hasn't reached Firebase yet is newer than this remote value
+                if key in unsynced_machine_states:
+                    continue
+                # Compare with what will be shown once already-queued changes are applied
+                if pending_remote_states.get(machine_num, cached_machine_states.get(key)) != state:
+                    changes[machine_num] = state
+        if not changes:
+            return
+        pending_remote_states.update(changes)
+        if remote_apply_scheduled:
+            return
+        remote_apply_scheduled = True
     # Schedule the update in the main thread
-    app.after(0, update_state)
+    app.after(0, apply_pending_remote_states)
+
+# Function to apply every queued remote change in a single main-thread callback
+def apply_pending_remote_states():
+    global remote_apply_scheduled, applying_remote_states
+    with pending_remote_states_lock:
+        changes = dict(pending_remote_states)
+        pending_remote_states.clear()
+        remote_apply_scheduled = False
+    changes = {machine_num: state for machine_num, state in changes.items() if machine_num in machine_states}
+    if not changes:
+        return
+
+    logging.debug(f"Applying {len(changes)} remote machine state change(s): {changes}")
+    applying_remote_states = True
+    try:
+        for machine_num, state in changes.items():
+            machine_states[machine_num].set(state)
+            update_image_funcs[machine_num]()
+    finally:
+        applying_remote_states = False
+    store_machine_states(changes, synced=True)
+
+# Function to turn a stream message into {machine_num: state}
+def parse_machine_states_message(path, data):
+    if path == "/":
+        # Initial data, full update or multi-path patch
+        if isinstance(data, dict):
+            return {int(machine_num_str): state for machine_num_str, state in data.items()
+                    if machine_num_str.isdigit() and state is not None}
+        if isinstance(data, list):
+            # Assuming machine numbers start at index 0
+            return {index: state for index, state in enumerate(data) if state is not None}
+        logging.warning(f"Unexpected data type received from Firebase: {type(data).__name__}")
+        return {}
+
+    # Data changed at a specific path
+    machine_num_str = path.strip('/')
+    if machine_num_str.isdigit():
+        return {int(machine_num_str): data}
+    logging.warning(f"Unexpected path format: {path}")
+    return {}
 
 # Stream handler function for Firebase
-# Stream handler function
 def stream_handler(message):
+    global firebase_sync_status
+    firebase_stream_stats["last_event"] = time.monotonic()  # Keep-alives count as activity too
     if message["data"] is None:
         return
 
     path = message["path"]
-    data = message["data"]
-
-    # Debugging output to inspect data
-    print(f"Received data at path '{path}': {data}")
-    print(f"Type of data: {type(data)}")
-
+    logging.debug(f"Firebase {message.get('event', 'event')} at path '{path}'.")
     if path == "/":
-        # Initial data or full update
-        if isinstance(data, dict):
-            # Data is a dictionary as expected
-            for machine_num_str, state in data.items():
-                machine_num = int(machine_num_str)
-                update_local_machine_state(machine_num, state)
-        elif isinstance(data, list):
-            # Data is a list, adjust handling accordingly
-            for index, state in enumerate(data):
-                if state is not None:
-                    machine_num = index  # Assuming machine numbers start at index 0
-                    update_local_machine_state(machine_num, state)
-        else:
-            print("Unexpected data type received from Firebase.")
-    else:
-        # Data changed at a specific path
-        machine_num_str = path.strip('/')
-        if machine_num_str.isdigit():
-            machine_num = int(machine_num_str)
-            state = data
-            update_local_machine_state(machine_num, state)
-        else:
-            print(f"Unexpected path format: {path}")
+        firebase_sync_status = "live"
+    update_local_machine_states(parse_machine_states_message(path, message["data"]))
 
-# Start the Firebase stream in a separate thread
+# Start the Firebase stream; pyrebase runs it on its own thread and returns the stream
 def start_firebase_stream():
-    db.child('machine_states').stream(stream_handler)
+    return db.child('machine_states').stream(stream_handler)
+
+# Stream supervisor settings
+STREAM_IDLE_TIMEOUT = 90          # Seconds without any event (Firebase sends keep-alives every ~30s)
+STREAM_CHECK_INTERVAL = 5         # Seconds between liveness checks
+STREAM_RETRY_BASE_DELAY = 1       # Seconds before the first reconnect attempt
+STREAM_RETRY_MAX_DELAY = 60       # Upper bound for the reconnect backoff
+STREAM_STABLE_SECONDS = 120       # A stream alive this long resets the backoff
+
+# Stream health shown in the status line
+firebase_stream_stats = {
+    "last_event": time.monotonic(),
+    "reconnects": 0,
+    "last_recovery_s": None,   # Time from noticing a dead stream to a resynced one
+}
+
+# Function to check whether a pyrebase stream is still delivering events
+def is_stream_alive(stream):
+    thread = getattr(stream, "thread", None)
+    if thread is not None and not thread.is_alive():
+        return False
+    return time.monotonic() - firebase_stream_stats["last_event"] < STREAM_IDLE_TIMEOUT
 
-stream_thread = threading.Thread(target=start_firebase_stream)
+# Function to close a stream without letting a half-dead connection raise
+def close_stream(stream):
+    try:
+        stream.close()
+    except Exception as e:
+        logging.debug(f"Error closing Firebase stream: {e}")
+
+# Function to fetch one consistent snapshot and feed it through the normal stream path
+def resync_machine_states():
+    data = db.child('machine_states').get().val()
+    stream_handler({"event": "put", "path": "/", "data": data})
+
+def supervise_firebase_stream():
+    """
+    Keeps the machine_states stream alive. A stream whose thread has died or that has gone
+    STREAM_IDLE_TIMEOUT without an event is closed and reopened with jittered backoff; after
+    each reconnect one snapshot is fetched so changes missed during the gap are applied.
+    """
+    global firebase_sync_status
+    delay = STREAM_RETRY_BASE_DELAY
+    lost_at = None  # When the current outage was noticed
+    while True:
+        try:
+            firebase_stream_stats["last_event"] = time.monotonic()
+            stream = start_firebase_stream()
+            if lost_at is not None:
+                resync_machine_states()
+                recovery = time.monotonic() - lost_at
+                firebase_stream_stats["reconnects"] += 1
+                firebase_stream_stats["last_recovery_s"] = recovery
+                logging.info(f"Firebase stream reconnected and resynced after {recovery:.1f}s.")
+                lost_at = None
+        except Exception as e:
+            logging.error(f"Error starting Firebase stream: {e}")
+            stream = None
+
+        opened_at = time.monotonic()
+        while stream is not None and is_stream_alive(stream):
+            time.sleep(STREAM_CHECK_INTERVAL)
+            if time.monotonic() - opened_at > STREAM_STABLE_SECONDS:
+                delay = STREAM_RETRY_BASE_DELAY
+
+        if stream is not None:
+            logging.warning("Firebase stream stopped delivering events; reconnecting.")
+            close_stream(stream)
+        if lost_at is None:
+            lost_at = time.monotonic()
+        firebase_sync_status = "reconnecting"
+
+        time.sleep(random.uniform(delay / 2, delay))
+        delay = min(STREAM_RETRY_MAX_DELAY, delay * 2)
+
+def connect_to_firebase():
+    """
+    Connects to Firebase in the background: initializes the app and the machine_states node,
+    lets the writer flush changes made while offline, then starts the stream, whose first
+    snapshot reconciles the stored states shown at startup. Retries until it succeeds.
+    """
+    global firebase, db, firebase_sync_status
+    while True:
+        try:
+            firebase = pyrebase.initialize_app(fireConfig)
+            db = firebase.database()
+            initialize_machine_states_in_firebase()
+            break
+        except Exception as e:
+            firebase_sync_status = "offline"
+            logging.error(f"Error connecting to Firebase, retrying in {FIREBASE_CONNECT_RETRY_DELAY}s: {e}")
+            time.sleep(FIREBASE_CONNECT_RETRY_DELAY)
+
+    firebase_sync_status = "syncing"
+    firebase_ready.set()
+    # Send local changes first so the stream's snapshot doesn't undo them
+    firebase_write_queue.join()
+    supervise_firebase_stream()
+
+stream_thread = threading.Thread(target=connect_to_firebase)
 stream_thread.daemon = True
 stream_thread.start()
 
+# ---- Machine claims: compare-and-set leases so two stations never stage the same machine ----
+# Claims live in their own node, machine_claims/m<N> = {"owner": ..., "expires": <epoch seconds>},
+# next to the 0/1 machine_states that drive the grid. Every change to the node is a conditional
+# PUT against the ETag of the copy it was based on, so concurrent stations can't both win.
+# Claims are recorded under STATION_ID from the staging engine.
+
+CLAIM_LEASE_SECONDS = 30 * 60      # A claim not renewed within this long is free for others
+CLAIM_RENEW_INTERVAL = 5 * 60      # Seconds between lease renewals while we hold claims
+CLAIM_MAX_ATTEMPTS = 5             # Conditional writes tried before giving up on contention
+CLAIM_REQUEST_TIMEOUT = 10         # Seconds per claim request
+
+owned_claims = set()               # Machines this station currently holds a claim on
+claims_available = True            # False when the claim node couldn't be reached; staging continues unguarded
+owned_claims_lock = threading.Lock()
+
+# Function to get the REST URL of the machine_claims node
+def get_claims_url():
+    return f"{(fireConfig['databaseURL'] or '').rstrip('/')}/machine_claims.json"
+
+# Function to read the machine_claims node together with its ETag
+def fetch_claims():
+    response = requests.get(get_claims_url(), headers={"X-Firebase-ETag": "true"}, timeout=CLAIM_REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json() or {}, response.headers["ETag"]
+
+# Function to replace the machine_claims node only if nobody has changed it since `etag`
+def put_claims_if_unchanged(claims, etag):
+    response = requests.put(get_claims_url(), json=claims, headers={"if-match": etag},
+                            timeout=CLAIM_REQUEST_TIMEOUT)
+    if response.status_code == 412:
+        return False  # Someone else changed the claims first
+    response.raise_for_status()
+    return True
+
+def update_claims(mutate):
+    """
+    Runs a compare-and-set loop on the machine_claims node. `mutate` receives the current claims,
+    changes them in place and returns a result; the change is retried from a fresh copy whenever
+    another station wrote in between.
+    """
+    for attempt in range(1, CLAIM_MAX_ATTEMPTS + 1):
+        claims, etag = fetch_claims()
+        result = mutate(claims)
+        if put_claims_if_unchanged(claims, etag):
+            return result
+        logging.debug(f"Machine claims changed concurrently (attempt {attempt}); retrying.")
+        time.sleep(random.uniform(0.05, 0.2 * attempt))
+    raise RuntimeError("Machine claims are under heavy contention; giving up.")
+
+# Function to check whether a claim is held by another station and still within its lease
+def is_claimed_by_other(claim, now):
+    return bool(claim) and claim.get("owner") != STATION_ID and claim.get("expires", 0) > now
+
+def claim_machines(machine_nums, renewal=False):
+    """
+    Claims every free machine in `machine_nums` in one conditional write. Returns the set of
+    machines now held by this station and a dict of machine -> owner for those held by others.
+    A renewal only extends claims that are still ours when the write is made, so a machine
+    released in the meantime isn't claimed again.
+    """
+    def mutate(claims):
+        now = time.time()
+        claimed, taken = set(), {}
+        for machine_num in machine_nums:
+            if renewal:
+                with owned_claims_lock:
+                    if machine_num not in owned_claims:
+                        continue
+            key = f"m{machine_num}"
+            if is_claimed_by_other(claims.get(key), now):
+                taken[machine_num] = claims[key]["owner"]
+            else:
+                claims[key] = {"owner": STATION_ID, "expires": now + CLAIM_LEASE_SECONDS}
+                claimed.add(machine_num)
+        return claimed, taken
+
+    claimed, taken = update_claims(mutate)
+    if not renewal:
+        with owned_claims_lock:
+            owned_claims.update(claimed)
+    return claimed, taken
+
+# Function to give back our claims on the given machines
+def release_machines(machine_nums):
+    def mutate(claims):
+        for machine_num in machine_nums:
+            claim = claims.get(f"m{machine_num}")
+            if claim and claim.get("owner") == STATION_ID:
+                del claims[f"m{machine_num}"]
+
+    update_claims(mutate)
+    with owned_claims_lock:
+        owned_claims.difference_update(machine_nums)
+
+# Function to give back every claim we hold, off the UI thread. They stop counting as ours
+# straight away, so renewal stops even if the release can't reach the database.
+def release_owned_claims():
+    with owned_claims_lock:
+        machine_nums = set(owned_claims)
+        owned_claims.clear()
+    if not machine_nums:
+        return None
+
+    def run_release():
+        try:
+            release_machines(machine_nums)
+        except Exception as e:
+            logging.error(f"Error releasing machine claims (they expire on their own): {e}")
+
+    release_thread = threading.Thread(target=run_release, daemon=True)
+    release_thread.start()
+    return release_thread
+
+# Background loop that extends our leases while we still hold claims
+def renew_claims():
+    while True:
+        time.sleep(CLAIM_RENEW_INTERVAL)
+        with owned_claims_lock:
+            machine_nums = set(owned_claims)
+        if not machine_nums:
+            continue
+        try:
+            claimed, taken = claim_machines(machine_nums, renewal=True)
+            if taken:
+                # Our lease lapsed and another station took over; stop treating these as ours
+                logging.warning(f"Lost claims on machines {sorted(taken)} to {sorted(set(taken.values()))}.")
+                with owned_claims_lock:
+                    owned_claims.difference_update(taken)
+        except Exception as e:
+            logging.error(f"Error renewing machine claims: {e}")
+
+claim_renew_thread = threading.Thread(target=renew_claims)
+claim_renew_thread.daemon = True
+claim_renew_thread.start()
+
+# Function to list the machines this station should stage: selected, and claimed by us when claims work
+def get_staging_machines():
+    with owned_claims_lock:
+        return [machine_num for machine_num, var in machine_states.items()
+                if var.get() == 1 and (not claims_available or machine_num in owned_claims)]
+
 # Function to update images when checkbox state changes
 def make_update_image(machine_num):
     def update_image():
@@ -261,7 +836,7 @@ def make_update_image(machine_num):
 # Function to handle image click events
 def on_image_click(event, machine_num):
     # Only toggle if the machine is not disabled
-    if machine_num < 10:
+    if is_machine_enabled(machine_num):
         # Toggle the variable
         current_value = machine_states[machine_num].get()
         machine_states[machine_num].set(0 if current_value else 1)
@@ -273,7 +848,8 @@ for row_index, row in enumerate(layout, start=3):  # Start from row 3 to accommo
     for machine_info in row:
         machine_num, col_index = machine_info
         # Create the variable for the checkbox
-        var = ctk.IntVar(value=0)  # 0 for unchecked, 1 for checked
+        # Start from the last-known state until Firebase's snapshot arrives (0 for unchecked, 1 for checked)
+        var = ctk.IntVar(value=cached_machine_states.get(str(machine_num), 0))
         machine_states[machine_num] = var
 
         # Set up a trace on the variable
@@ -294,7 +870,7 @@ for row_index, row in enumerate(layout, start=3):  # Start from row 3 to accommo
         checkbox = ctk.CTkCheckBox(frame1, text=f"Machine {machine_num}", variable=var, command=update_image_func)
         checkbox.grid(row=row_index*2, column=col_index, padx=20, pady=5, sticky="n")
 
-        if machine_num >= 10:
+        if not is_machine_enabled(machine_num):
             # Disable the checkbox
             checkbox.configure(state="disabled")
             # Disable image click
@@ -305,18 +881,94 @@ for row_index, row in enumerate(layout, start=3):  # Start from row 3 to accommo
             # Change cursor to indicate clickable image
             image_label.configure(cursor="hand2")
 
+        # Show the cached selection on the image as well
+        if var.get() == 1:
+            update_image_func()
+
 # Validation and switching function for submit button
 def validate_and_proceed_to_frame2():
     selected_machines = [machine_num for machine_num, var in machine_states.items() if var.get() == 1]
     if not selected_machines:
         messagebox.showerror("Error", "Please select at least one machine before proceeding.")
-    else:
+        return
+
+    # Claim the whole selection in one operation off the UI thread
+    next_button.configure(state="disabled", text="Claiming machines...")
+
+    def run_claim():
+        try:
+            result = claim_machines(selected_machines)
+        except Exception as e:
+            result = e
+        app.after(0, lambda: finish_claim(result))
+
+    threading.Thread(target=run_claim, daemon=True).start()
+
+# Function to continue to Frame 2 once the claim has been decided
+def finish_claim(result):
+    global claims_available
+    next_button.configure(state="normal", text="Submit")
+    if isinstance(result, Exception):
+        # Without the cloud there's nothing to claim against; keep staging on the LAN shares
+        logging.error(f"Could not claim machines, continuing without claims: {result}")
+        claims_available = False
         switch_frame(frame2)
+        return
+
+    claims_available = True
+    claimed, taken = result
+    if taken:
+        details = "\n".join(f"Machine {machine_num}: {owner}" for machine_num, owner in sorted(taken.items()))
+        messagebox.showwarning("Machines In Use",
+                               f"These machines are being staged by another station and will be skipped:\n{details}")
+    if not claimed:
+        return
+    switch_frame(frame2)
+
+# Function to return to Frame 1, giving up the claims made on Submit
+def back_to_frame1():
+    release_owned_claims()
+    switch_frame(frame1)
 
 # Submit button with validation
 next_button = ctk.CTkButton(frame1, text="Submit", command=validate_and_proceed_to_frame2)
 next_button.grid(row=(len(layout) * 2 + 3), column=1, columnspan=2, pady=10, sticky="we")
 
+# Status line showing how the Firebase writer is keeping up
+db_status_label = ctk.CTkLabel(frame1, text="", font=("Arial", 11))
+db_status_label.grid(row=(len(layout) * 2 + 4), column=0, columnspan=layout_columns, pady=(0, 5))
+
+# Function to refresh the Firebase writer status line
+def refresh_db_status():
+    with firebase_writer_lock:
+        stats = dict(firebase_writer_stats)
+    queue_depth = firebase_write_queue.qsize() + len(pending_state_writes)
+    if firebase_sync_status != "live":
+        status_text = {
+            "connecting": "Connecting to Firebase... showing last-known machine states",
+            "syncing": "Syncing machine states with Firebase...",
+            "reconnecting": "Firebase stream lost, reconnecting... showing last-known machine states",
+            "offline": "Firebase unreachable, retrying... showing last-known machine states",
+        }[firebase_sync_status]
+        db_status_label.configure(text=f"{status_text} ({queue_depth} change(s) waiting)", text_color="orange")
+        app.after(1000, refresh_db_status)
+        return
+    text = f"Firebase writes: {queue_depth} queued"
+    if stats["in_flight"]:
+        text += f", {stats['in_flight']} in flight"
+    if stats["last_latency_ms"] is not None:
+        text += f" | last {stats['last_latency_ms']:.0f} ms, avg {stats['avg_latency_ms']:.0f} ms"
+    if stats["retries"]:
+        text += f" | {stats['retries']} retries"
+    if firebase_stream_stats["reconnects"]:
+        text += (f" | stream reconnects {firebase_stream_stats['reconnects']}, "
+                 f"last recovery {firebase_stream_stats['last_recovery_s']:.1f}s")
+    behind = (queue_depth > 0 and stats["in_flight"] > 0) or (stats["avg_latency_ms"] or 0) > FIREBASE_SLOW_WRITE_MS
+    db_status_label.configure(text=text, text_color="orange" if behind else "gray")
+    app.after(1000, refresh_db_status)
+
+refresh_db_status()
+
 # ---- Frame 2: File Uploads (Scrollable Frame with Colored Buttons) ----
 
 # Configure frame2 to expand and fill available space
@@ -391,15 +1043,23 @@ def clear_letter_files():
 
 # Function to validate input and proceed
 def validate_and_proceed():
-    selected_machines = [machine_num for machine_num, var in machine_states.items() if var.get() == 1]
+    selected_machines = get_staging_machines()
     if not envelope_files and not letter_files:
         messagebox.showerror("Error", "Please upload either envelope files or letter files before proceeding.")
     elif not selected_machines:
         messagebox.showerror("Error", "Please select at least one machine before proceeding.")
     else:
+        unlock_frame3()
         display_file_assignments()
         switch_frame(frame3)
-    transfer_button.configure(state="disabled")
+    transfer_button.configure(state="normal" if cleanup_before_upload_var.get() == 1 else "disabled")
+
+# Function to undo release_stage_claims once Frame 3 is reached with freshly claimed machines
+def unlock_frame3():
+    global stage_claims_released
+    stage_claims_released = False
+    delete_button.configure(state="normal")
+    back_button.configure(text="Back")
 
 # Place widgets inside the scrollable frame
 
@@ -461,6 +1121,15 @@ clear_letter_button = ctk.CTkButton(
 )
 clear_letter_button.grid(row=7, column=0, padx=20, pady=20, sticky="ew", columnspan=2)
 
+# Option to stage the same file on every selected machine
+same_file_for_all_var = ctk.IntVar(value=0)
+same_file_checkbox = ctk.CTkCheckBox(
+    scrollable_frame2,
+    text="Send the first selected file to every selected machine",
+    variable=same_file_for_all_var
+)
+same_file_checkbox.grid(row=8, column=0, padx=20, pady=(0, 10), sticky="w", columnspan=2)
+
 # Submit Button (Green)
 submit_button_frame2 = ctk.CTkButton(
     scrollable_frame2,
@@ -470,17 +1139,16 @@ submit_button_frame2 = ctk.CTkButton(
     hover_color="#006400",   # Darker green on hover
     text_color="white"
 )
-submit_button_frame2.grid(row=8, column=0, padx=20, pady=20, sticky="ew", columnspan=2)
+submit_button_frame2.grid(row=9, column=0, padx=20, pady=20, sticky="ew", columnspan=2)
 
 # Back Button to return to Frame 1
 back_button = ctk.CTkButton(
-    scrollable_frame2, text="Back", command=lambda: switch_frame(frame1)
+    scrollable_frame2, text="Back", command=back_to_frame1
 )
-back_button.grid(row=9, column=0, padx=20, pady=20, sticky="ew", columnspan=2)
+back_button.grid(row=10, column=0, padx=20, pady=20, sticky="ew", columnspan=2)
 
 # ---- Frame 3: Scrollable File Assignment Display ----
 
-fileErrors = {}  # Dictionary to store machine_num as keys and failed file names as values
 green_popup = None  # Global variable to store the green popup window reference
 
 # Configure frame3 to expand and hold the scrollable frame and buttons
@@ -496,15 +1164,133 @@ scrollable_frame.grid(row=0, column=0, columnspan=2, padx=5, pady=5, sticky="nse
 # Global variable to store file assignments
 file_assignments = []  # List of tuples: (machine number, file path)
 
-def display_file_assignments(completed=False):
-    global file_assignments
-    file_assignments = []  # Clear previous assignments
+# ---- Frame 3 progress list: a fixed pool of rows bound to a view model ----
+# Only PROGRESS_VISIBLE_ROWS label/bar pairs ever exist. Scrolling rebinds them to other
+# entries of progress_rows_model, and a row is only reconfigured when its values change,
+# so redraw cost doesn't depend on how many files are being staged.
+
+PROGRESS_VISIBLE_ROWS = 10
+PROGRESS_FRAME_MS = 100      # How often the UI samples transfer progress
+
+progress_rows_model = []     # One dict per assignment: machine_num, text, progress, color
+progress_row_index = {}      # machine_num -> index in progress_rows_model
+progress_row_widgets = []    # Pool of rows: label, bar and the values they currently show
+progress_view_offset = 0     # Index of the model entry shown in the first row
+
+progress_view = ctk.CTkFrame(frame3)
+progress_view.grid(row=0, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+progress_view.grid_columnconfigure(0, weight=1)
+progress_view.grid_remove()  # Shown only while transferring
+
+# Aggregate throughput and ETA for the whole stage
+progress_summary_label = ctk.CTkLabel(progress_view, text="", font=("Arial", 12, "bold"))
+progress_summary_label.grid(row=0, column=0, columnspan=2, sticky="w", padx=10, pady=(5, 5))
+
+# Function to scroll the progress list from the scrollbar ("moveto"/"scroll" commands)
+def scroll_progress_view(action, amount, unit=None):
+    global progress_view_offset
+    max_offset = max(0, len(progress_rows_model) - PROGRESS_VISIBLE_ROWS)
+    if action == "moveto":
+        offset = round(float(amount) * len(progress_rows_model))
+    else:
+        step = PROGRESS_VISIBLE_ROWS if unit == "pages" else 1
+        offset = progress_view_offset + int(amount) * step
+    progress_view_offset = min(max_offset, max(0, offset))
+    render_progress_view()
+
+# Function to scroll the progress list with the mouse wheel
+def on_progress_mouse_wheel(event):
+    scroll_progress_view("scroll", -1 if event.delta > 0 else 1, "units")
+
+progress_scrollbar = ctk.CTkScrollbar(progress_view, command=scroll_progress_view)
+progress_scrollbar.grid(row=1, column=1, rowspan=PROGRESS_VISIBLE_ROWS * 2, sticky="ns")
+progress_view.bind("<MouseWheel>", on_progress_mouse_wheel)
+
+for i in range(PROGRESS_VISIBLE_ROWS):
+    label = ctk.CTkLabel(progress_view, text="")
+    label.grid(row=i * 2 + 1, column=0, sticky="w", padx=10)
+    progress_bar = ctk.CTkProgressBar(progress_view, orientation="horizontal", width=500)
+    progress_bar.grid(row=i * 2 + 2, column=0, pady=5)
+    progress_bar.set(0)
+    label.bind("<MouseWheel>", on_progress_mouse_wheel)
+    progress_bar.bind("<MouseWheel>", on_progress_mouse_wheel)
+    progress_row_widgets.append({
+        "label": label,
+        "bar": progress_bar,
+        "default_color": progress_bar.cget("fg_color"),
+        "visible": True,
+        "text": "",
+        "progress": 0,
+        "color": None,
+    })
+
+# Function to load a new set of assignments into the progress list
+def set_progress_rows(assignments):
+    global progress_view_offset
+    progress_rows_model.clear()
+    progress_row_index.clear()
+    for machine_num, file_path in assignments:
+        if machine_num in progress_row_index:
+            continue  # One row per machine, even when it stages several files
+        progress_row_index[machine_num] = len(progress_rows_model)
+        progress_rows_model.append({
+            "machine_num": machine_num,
+            "text": f"Machine {machine_num} File Transfer Progress:",
+            "progress": 0,
+            "color": None,  # None, "red" for failed or "green" for completed
+        })
+    progress_view_offset = 0
+    progress_summary_label.configure(text="")
+    render_progress_view()
+
+# Function to draw the visible slice of the progress model onto the row pool
+def render_progress_view():
+    for i, row in enumerate(progress_row_widgets):
+        index = progress_view_offset + i
+        if index >= len(progress_rows_model):
+            if row["visible"]:
+                row["label"].grid_remove()
+                row["bar"].grid_remove()
+                row["visible"] = False
+            continue
+        if not row["visible"]:
+            row["label"].grid()
+            row["bar"].grid()
+            row["visible"] = True
+
+        entry = progress_rows_model[index]
+        if row["text"] != entry["text"]:
+            row["text"] = entry["text"]
+            row["label"].configure(text=entry["text"])
+        if row["progress"] != entry["progress"]:
+            row["progress"] = entry["progress"]
+            row["bar"].set(entry["progress"])
+        if row["color"] != entry["color"]:
+            row["color"] = entry["color"]
+            row["bar"].configure(fg_color=entry["color"] or row["default_color"])
+
+    total = len(progress_rows_model)
+    if total > PROGRESS_VISIBLE_ROWS:
+        progress_scrollbar.set(progress_view_offset / total, (progress_view_offset + PROGRESS_VISIBLE_ROWS) / total)
+    else:
+        progress_scrollbar.set(0, 1)
+
+# Functions to switch the Frame 3 area between the assignment grid and the progress list
+def show_assignment_view():
+    progress_view.grid_remove()
+    scrollable_frame.grid()
+
+def show_progress_view():
+    scrollable_frame.grid_remove()
+    progress_view.grid()
 
-    for widget in scrollable_frame.winfo_children():  # Clear previous widgets
-        widget.destroy()
+# Assignment grid widgets, created once by build_assignment_grid and updated in place
+assignment_labels = {}       # machine_num -> label
+assignment_label_state = {}  # machine_num -> (text, color) currently shown
 
+def build_assignment_grid():
     # Configure columns in scrollable_frame
-    for i in range(4):  # Assuming 4 columns as in layout
+    for i in range(layout_columns):
         scrollable_frame.grid_columnconfigure(i, weight=1)
 
     # Add title label at the top
@@ -513,7 +1299,47 @@ def display_file_assignments(completed=False):
         text="File Assignments to Machines",
         font=("Arial", 16, "bold")
     )
-    title_label.grid(row=0, column=0, columnspan=4, pady=10)
+    title_label.grid(row=0, column=0, columnspan=layout_columns, pady=10)
+
+    row_index_start = 1  # Start from row 1 since title is at row 0
+    for row_index, row in enumerate(layout, start=row_index_start):
+        for machine_num, col_index in row:
+            label = ctk.CTkLabel(
+                scrollable_frame,
+                text="",
+                font=("Arial", 10),
+                text_color="black",
+                wraplength=100,
+                width=120,
+                height=60,
+                corner_radius=8,
+                fg_color="#F0F0F0",
+                justify="center"
+            )
+            label.grid(row=row_index, column=col_index, padx=5, pady=5)
+            assignment_labels[machine_num] = label
+
+# Function to pair the selected files with the selected machines
+def build_file_assignments():
+    # Determine which files are uploaded
+    if envelope_files:
+        all_files = envelope_files
+    elif letter_files:
+        all_files = letter_files
+    else:
+        all_files = []
+
+    return assign_files(all_files, get_staging_machines(), same_file=same_file_for_all_var.get() == 1)
+
+def display_file_assignments(completed=False):
+    global file_assignments
+    # The finished view shows the plan that was staged rather than planning again
+    if not completed:
+        file_assignments = build_file_assignments()
+
+    if not assignment_labels:
+        build_assignment_grid()
+    show_assignment_view()
 
     # Get all machine numbers from the layout
     all_machine_numbers = set()
@@ -525,32 +1351,23 @@ def display_file_assignments(completed=False):
     # Initialize machine_assignments dict with machine numbers directly mapped to their file paths
     machine_assignments = {machine_num: None for machine_num in all_machine_numbers}
 
-    # Determine which files are uploaded
-    if envelope_files:
-        all_files = envelope_files
-    elif letter_files:
-        all_files = letter_files
-    else:
-        all_files = []
+    machine_files = {}
+    for machine_num, file_path in file_assignments:
+        machine_files.setdefault(machine_num, [])
+        if file_path is not None:
+            machine_files[machine_num].append(os.path.basename(file_path))
+    selected_machines = set(machine_files)
 
-    # Get selected machines and assign files in order
-    selected_machines = sorted([machine_num for machine_num, var in machine_states.items() if var.get() == 1])
-
-    # Create direct machine-to-file assignments
-    for index, machine_num in enumerate(selected_machines):
-        if index < len(all_files):
-            file_path = all_files[index]
-            file_name = os.path.basename(file_path)
-            # Store the assignment
-            file_assignments.append((machine_num, file_path))
-            machine_assignments[machine_num] = file_name
-        else:
-            file_assignments.append((machine_num, None))
+    for machine_num, file_names in machine_files.items():
+        if not file_names:
             machine_assignments[machine_num] = "No file assigned"
+        elif len(file_names) == 1:
+            machine_assignments[machine_num] = file_names[0]
+        else:
+            machine_assignments[machine_num] = f"{file_names[0]}\n+{len(file_names) - 1} more ({len(file_names)} files)"
 
-    # Now create labels in the grid layout with conditional background colors
-    row_index_start = 1  # Start from row 1 since title is at row 0
-    for row_index, row in enumerate(layout, start=row_index_start):
+    # Now update the labels in the grid layout with conditional background colors
+    for row in layout:
         for machine_info in row:
             machine_num, col_index = machine_info
             # Get the file assigned to this machine
@@ -575,34 +1392,13 @@ def display_file_assignments(completed=False):
                     label_text = f"Machine {machine_num} \n {file_name}"                 
                 background_color = "#F0F0F0"  # Light gray for unselected
 
-            label = ctk.CTkLabel(
-                scrollable_frame,
-                text=label_text,
-                font=("Arial", 10),
-                text_color="black",
-                wraplength=100,
-                width=120,
-                height=60,
-                corner_radius=8,
-                fg_color=background_color,  # Dynamic background color based on transfer status
-                justify="center"
-            )
-            label.grid(row=row_index, column=col_index, padx=5, pady=5)
-
-# Define destination directories
-destination_directories = [
-    Path(r"\\192.168.68.81\DavWWWRoot"),
-    Path(r"\\192.168.68.75\DavWWWRoot"),
-    Path(r"\\192.168.68.76\DavWWWRoot"),
-    Path(r"\\192.168.68.77\DavWWWRoot"),
-    Path(r"\\192.168.68.78\DavWWWRoot"),
-    Path(r"\\192.168.68.79\DavWWWRoot"),
-    Path(r"\\192.168.68.80\DavWWWRoot"),
-    Path(r"\\192.168.68.83\DavWWWRoot"),
-    Path(r"\\192.168.68.82\DavWWWRoot"),
-    Path(r"\\192.168.68.70\DavWWWRoot"),
-    Path(r"\\192.168.68.84\DavWWWRoot")
-]
+            # Only touch labels whose text or color actually changed
+            if assignment_label_state.get(machine_num) != (label_text, background_color):
+                assignment_label_state[machine_num] = (label_text, background_color)
+                assignment_labels[machine_num].configure(
+                    text=label_text,
+                    fg_color=background_color  # Dynamic background color based on transfer status
+                )
 
 # Modify the delete function to enable Transfer button after deleting .bin files
 def delete_bin_files():
@@ -613,128 +1409,88 @@ def delete_bin_files():
     else:
         messagebox.showinfo("Info", "No .bin files found.")
 
-def transfer_files_to_machines():
+def transfer_files_to_machines(assignments=None, cleanup_first=None):
     """
     Transfers files to the specified destination directories based on file assignments
-    already displayed on Frame 3. Limits transfers to the number of files available.
+    already displayed on Frame 3, or only `assignments` when given (used to retry failures).
+    Limits transfers to the number of files available.
     """
     logging.info("Starting file transfer process.")
+    if assignments is None:
+        assignments = file_assignments
+    if cleanup_first is None:
+        cleanup_first = cleanup_before_upload_var.get() == 1
     
     # Filter `file_assignments` to only include entries with a valid file path
-    file_assignments_with_files = [(machine_num, file_path) for machine_num, file_path in file_assignments if file_path]
+    file_assignments_with_files = [(machine_num, file_path) for machine_num, file_path in assignments if file_path]
     
     if not file_assignments_with_files:
         logging.warning("No file assignments with valid files found. Aborting transfer.")
         messagebox.showwarning("Warning", "No valid file assignments found.")
         return
 
-    # Clear previous widgets in the scrollable frame and set up progress bars for each valid assignment
-    for widget in scrollable_frame.winfo_children():
-        widget.destroy()
-
-    progress_bars = []
-    progress_bar_mapping = {}  # Mapping of machine_num to progress bar index
-
-    for i, (machine_num, file_path) in enumerate(file_assignments_with_files):
-        label = ctk.CTkLabel(scrollable_frame, text=f"Machine {machine_num} File Transfer Progress:")
-        label.pack(anchor="w", padx=10)
-        progress_bar = ctk.CTkProgressBar(scrollable_frame, orientation="horizontal", width=500)
-        progress_bar.pack(pady=5)
-        progress_bar.set(0)
-        progress_bars.append(progress_bar)
-        progress_bar_mapping[machine_num] = i  # Map machine_num to the progress bar's index
+    # Load the assignments into the progress list and show it in place of the assignment grid
+    set_progress_rows(file_assignments_with_files)
+    show_progress_view()
 
     # Show "red-image.png" popup with specific dimensions as a warning until all transfers complete
+    retry_button.configure(state="disabled")
     popup_red = show_popup("red-image.png", 793, 655)
 
     # Start concurrent file transfers
     copy_complete_event = threading.Event()
-    progress_queue = queue.Queue()
+    progress_slots = {}  # machine_num -> latest progress, sampled by update_progress
+    telemetry = start_transfer_telemetry(file_assignments_with_files)
     threading.Thread(
         target=start_copying_files,
-        args=(file_assignments_with_files, progress_queue, copy_complete_event, progress_bar_mapping)
+        args=(file_assignments_with_files, progress_slots, copy_complete_event, progress_row_index),
+        kwargs={"cleanup_first": cleanup_first}
     ).start()
-    update_progress(progress_queue, progress_bars, popup_red, copy_complete_event, progress_bar_mapping)
-
-def start_copying_files(file_assignments, progress_queue, copy_complete_event, progress_bars):
-    """
-    Start file copy operations concurrently, using the filtered file_assignments list.
-    Limits the operation to the number of files available.
-    """
-    with ThreadPoolExecutor() as executor:
-        futures = []
-        for machine_num, file_path in file_assignments:
-            if file_path is not None and machine_num <= len(destination_directories):
-                dest_dir = destination_directories[machine_num - 1]
-                futures.append(executor.submit(copy_file, file_path, dest_dir, machine_num, progress_queue))
-            else:
-                logging.warning(f"No destination path or file for Machine {machine_num}. Skipping.")
-                progress_queue.put((machine_num, -1))  # Mark progress as complete for skipped files
+    update_progress(progress_slots, popup_red, copy_complete_event, telemetry)
 
-        for future in futures:
-            future.result()  # Wait for all threads to complete
-
-    copy_complete_event.set()  # Signal that all copies are complete
-
-def copy_file(src_path, dest_dir, machine_num, progress_queue):
-    """
-    Copies the selected file to the specified destination directory and sends progress updates.
-    If a file transfer fails, sends a progress of -1 to indicate failure.
+def update_progress(progress_slots, popup_red, copy_complete_event, telemetry):
     """
-    dest_path = dest_dir / Path(src_path).name
-    file_name = os.path.basename(src_path)  # Get the base file name
-    try:
-        total_size = os.path.getsize(src_path)
-        copied_size = 0
-
-        with open(src_path, "rb") as src, open(dest_path, "wb") as dest:
-            while chunk := src.read(1024 * 1024):  # Read in chunks
-                dest.write(chunk)
-                copied_size += len(chunk)
-                
-                # Calculate progress as a fraction
-                progress = min(1.0, copied_size / total_size)
-                progress_queue.put((machine_num, progress))  # Send progress update
-
-    except Exception as e:
-        logging.error(f"Error copying file to {dest_dir} for Machine {machine_num}: {e}")
-        # Confirm that we’re sending -1 to indicate failure
-        logging.debug(f"Queueing failure for Machine {machine_num}")
-        progress_queue.put((machine_num, -1))  # Send -1 to indicate a failure
-        fileErrors[machine_num] = file_name  # Add to global fileErrors with machine_num as key and file name as value
-        messagebox.showerror("Error", f"Error copying file to {dest_dir}:\n{e}")
-
-def update_progress(progress_queue, progress_bars, popup_red, copy_complete_event, progress_bar_mapping):
+    Copy the latest value in each machine's slot and its telemetry into the progress view
+    model, then redraw the visible rows and handle completion. Runs once per PROGRESS_FRAME_MS
+    frame, so its cost doesn't grow with file size. Marks failed transfers in red.
     """
-    Update progress bars from the queue and handle completion. Marks failed transfers in red.
-    """
-    failed_machines = set()  # To keep track of failed transfers by machine number
-
-    def process_queue():
-        while not progress_queue.empty():
-            machine_num, progress = progress_queue.get_nowait()
-            logging.debug(f"Processing queue item for Machine {machine_num} with progress: {progress}")
-
-            # Use the mapping to get the correct progress bar index
-            if machine_num in progress_bar_mapping:
-                bar_index = progress_bar_mapping[machine_num]
-                if progress == -1:
-                    # Mark this machine as failed
-                    failed_machines.add(machine_num)
-                    progress_bars[bar_index].configure(fg_color="red")
-                    logging.debug(f"Machine {machine_num} added to failed_machines due to transfer failure.")
-                else:
-                    progress_bars[bar_index].set(progress)
-                    # Only set to green if the transfer is successful (progress reaches 1.0)
-                    if progress >= 1.0:
-                        progress_bars[bar_index].configure(fg_color="green")
-            else:
-                logging.warning(f"Machine {machine_num} not found in progress bar mapping.")
-
-    process_queue()
-    if not copy_complete_event.is_set():
-        app.after(100, lambda: update_progress(progress_queue, progress_bars, popup_red, copy_complete_event, progress_bar_mapping))
+    # Check for completion before sampling so the final values are always drawn
+    copies_done = copy_complete_event.is_set()
+
+    for machine_num, progress in list(progress_slots.items()):
+        # Use the mapping to get the correct row of the view model
+        if machine_num not in progress_row_index:
+            logging.warning(f"Machine {machine_num} not found in progress row mapping.")
+            continue
+        entry = progress_rows_model[progress_row_index[machine_num]]
+        if progress == -1:
+            # Mark this machine as failed
+            if entry["color"] != "red":
+                logging.debug(f"Machine {machine_num} marked as failed due to transfer failure.")
+            entry["color"] = "red"
+        else:
+            entry["progress"] = progress
+            # Only set to green if the transfer is successful (progress reaches 1.0)
+            entry["color"] = "green" if progress >= 1.0 else None
+
+    sample_transfer_telemetry(telemetry, time.time())
+    with telemetry_lock:
+        entries = {machine_num: dict(entry) for machine_num, entry in telemetry["machines"].items()}
+    for machine_num, entry in entries.items():
+        if machine_num in progress_row_index:
+            progress_rows_model[progress_row_index[machine_num]]["text"] = describe_machine_telemetry(machine_num, entry)
+    summary = describe_run_telemetry(telemetry)
+    if progress_summary_label.cget("text") != summary:
+        progress_summary_label.configure(text=summary)
+
+    render_progress_view()
+
+    if not copies_done:
+        app.after(PROGRESS_FRAME_MS, lambda: update_progress(progress_slots, popup_red, copy_complete_event, telemetry))
     else:
+        export_transfer_telemetry(telemetry)
+        # The stage is over, so let other stations have its machines
+        release_stage_claims()
         hide_popup(popup_red)
         show_popup("green-image.png", 749, 629, is_green=True)
         winsound.PlaySound("tada-alldone.wav", winsound.SND_FILENAME | winsound.SND_ASYNC)
@@ -742,6 +1498,13 @@ def update_progress(progress_queue, progress_bars, popup_red, copy_complete_even
         # Call display_file_assignments to reflect completion
         display_file_assignments(completed=True)
 
+        # Report every failure once, from the UI thread, instead of a dialog per failed copy
+        failures = [f"Machine {machine_num}: {entry['error']}" for machine_num, entry in sorted(entries.items())
+                    if entry["status"] == "failed"]
+        retry_button.configure(state="normal" if retryable_transfers else "disabled")
+        if failures:
+            messagebox.showerror("Error", "Some transfers failed:\n" + "\n".join(failures), parent=green_popup)
+
 # Helper functions for popups
 def show_popup(image_file, width, height, is_green=False):
     global green_popup
@@ -764,36 +1527,61 @@ def hide_popup(popup_window):
     if popup_window:
         popup_window.destroy()
 
-# New method to delete .bin files in selected machines' destination directories
+# Function to clean every selected machine concurrently in the background
 def delete_bin_files():
-    selected_machines = [machine_num for machine_num, var in machine_states.items() if var.get() == 1]
+    selected_machines = get_staging_machines()
     if not selected_machines:
         messagebox.showinfo("Info", "No machines selected. Please select machines before attempting to delete .bin files.")
         return
 
-    bin_files_deleted = 0
-    for machine_num in selected_machines:
-        # Get the directory associated with the selected machine number
-        if machine_num <= len(destination_directories):
-            directory = destination_directories[machine_num - 1]
-            for file_path in directory.glob("*.bin"):
-                try:
-                    os.remove(file_path)
-                    bin_files_deleted += 1
-                except Exception as e:
-                    messagebox.showerror("Error", f"Error deleting {file_path}: {e}")
+    delete_button.configure(state="disabled", text="Deleting .bin Files...")
 
-    if bin_files_deleted > 0:
+    def run_cleanup():
+        results = clean_machines(selected_machines)
+        app.after(0, lambda: show_cleanup_summary(results))
+
+    threading.Thread(target=run_cleanup, daemon=True).start()
+
+# Function to report the combined cleanup results once every machine has finished
+def show_cleanup_summary(results):
+    delete_button.configure(state="normal", text="Delete .bin Files from Selected Machines")
+    bin_files_deleted = sum(result["deleted"] for result in results)
+    failed = [result for result in results if result["errors"]]
+
+    if failed:
+        details = "\n".join(f"Machine {result['machine']}: {result['errors'][0]}"
+                            + (f" (+{len(result['errors']) - 1} more)" if len(result["errors"]) > 1 else "")
+                            for result in failed)
+        messagebox.showerror("Error", f"Deleted {bin_files_deleted} .bin files, but some machines had errors:\n{details}")
+    elif bin_files_deleted > 0:
         messagebox.showinfo("Success", f"Deleted {bin_files_deleted} .bin files from selected machines.")
     else:
         messagebox.showinfo("Info", "No .bin files found on selected machines.")
     transfer_button.configure(state="enabled")
 
-# Function for the back button to return to Frame 2
+# Set once a finished stage has given its claims back; Frame 3's machines are no longer ours
+stage_claims_released = False
+
+# Function to give back a finished stage's claims and lock Frame 3 until the machines are
+# claimed again through Frame 1, so the same assignments can't be staged unguarded
+def release_stage_claims():
+    global stage_claims_released
+    release_owned_claims()
+    if not claims_available:
+        return  # Nothing was claimed, so the selection still stands
+    stage_claims_released = True
+    transfer_button.configure(state="disabled")
+    delete_button.configure(state="disabled")
+    back_button.configure(text="Back to Machine Selection")
+
+# Function for the back button to return to Frame 2, or Frame 1 once the stage's claims are gone
 def back_to_frame2():
     global fileErrors
     fileErrors.clear()  # Clear fileErrors when navigating back to Frame 2
     hide_popup(green_popup)
+    if stage_claims_released:
+        back_to_frame1()
+        return
     switch_frame(frame2)
 
 
@@ -820,10 +1608,83 @@ transfer_button = ctk.CTkButton(
 )
 transfer_button.grid(row=1, column=1, padx=(10, 20), pady=20, sticky="ew")
 
+# Option to clean each machine as part of its own upload instead of as a separate step
+cleanup_before_upload_var = ctk.IntVar(value=0)
+
+def on_cleanup_option_change():
+    # Cleanup happens inside the transfer, so the separate delete step isn't needed first
+    if cleanup_before_upload_var.get() == 1 and not stage_claims_released:
+        transfer_button.configure(state="normal")
+
+cleanup_before_upload_checkbox = ctk.CTkCheckBox(
+    frame3,
+    text="Delete .bin files on each machine just before its upload",
+    variable=cleanup_before_upload_var,
+    command=on_cleanup_option_change
+)
+cleanup_before_upload_checkbox.grid(row=2, column=1, padx=(10, 20), pady=20, sticky="w")
+
+# Function to re-send only the (machine, file) pairs that failed in the last run
+def retry_failed_transfers():
+    if not retryable_transfers:
+        return
+    hide_popup(green_popup)
+    assignments = list(retryable_transfers)
+    for machine_num, _ in assignments:
+        fileErrors.pop(machine_num, None)
+    if not claims_available:
+        finish_retry_claim(assignments, None)
+        return
+
+    # The stage's claims were given back when it finished, so claim the failed machines again
+    retry_button.configure(state="disabled", text="Claiming machines...")
+
+    def run_claim():
+        try:
+            result = claim_machines({machine_num for machine_num, _ in assignments})
+        except Exception as e:
+            result = e
+        app.after(0, lambda: finish_retry_claim(assignments, result))
+
+    threading.Thread(target=run_claim, daemon=True).start()
+
+# Function to retry the failed transfers on the machines we could claim again
+def finish_retry_claim(assignments, result):
+    retry_button.configure(text="Retry Failed Only")
+    if isinstance(result, Exception):
+        logging.error(f"Could not claim machines, retrying without claims: {result}")
+    elif result is not None:
+        claimed, taken = result
+        if taken:
+            details = "\n".join(f"Machine {machine_num}: {owner}" for machine_num, owner in sorted(taken.items()))
+            messagebox.showwarning("Machines In Use",
+                                   f"These machines are being staged by another station and will be skipped:\n{details}")
+        assignments = [(machine_num, file_path) for machine_num, file_path in assignments if machine_num in claimed]
+        if not assignments:
+            retry_button.configure(state="normal")
+            return
+    # The failed machines were already cleaned, and cleaning again would remove files that arrived
+    transfer_files_to_machines(assignments=assignments, cleanup_first=False)
+
+retry_button = ctk.CTkButton(
+    frame3, text="Retry Failed Only", command=retry_failed_transfers, state="disabled",
+    fg_color="#CC7A00", hover_color="#995C00", text_color="white"
+)
+retry_button.grid(row=3, column=0, columnspan=2, padx=20, pady=(0, 20), sticky="ew")
+
 # Configure columns to have equal weight for even distribution
 frame3.grid_columnconfigure(0, weight=1)
 frame3.grid_columnconfigure(1, weight=1)
 
+# Function to close the app without leaving our machines claimed until their leases run out
+def close_app():
+    release_thread = release_owned_claims()
+    if release_thread:
+        release_thread.join(CLAIM_REQUEST_TIMEOUT)
+    app.destroy()
+
+app.protocol("WM_DELETE_WINDOW", close_app)
+
 # Start with Frame 1 visible
 switch_frame(frame1)
 
@@ -0,0 +1,229 @@
+# Transfer benchmark: runs the staging engine against local stand-in destinations.
+# Every machine is a temporary directory whose writes are slowed to a configurable per-card
+# latency and bandwidth, share an access point's bandwidth, and can fail at random.
+#     python bench_transfer.py --sizes 1,8 --machines 3,9 --repeat 3
+#     python bench_transfer.py --json baseline.json
+#     python bench_transfer.py --baseline baseline.json   (exits 1 on a regression)
+
+import os
+import sys
+import argparse
+import json
+import logging
+import math
+import random
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import staging_engine as engine
+
+
+# A destination file whose writes take as long as they would over a slow card and a shared access point
+class StandInFile:
+    def __init__(self, file, profile, medium):
+        self.file = file
+        self.profile = profile
+        self.medium = medium
+
+    def write(self, data):
+        profile = self.profile
+        if profile["failure_rate"] and profile["rng"].random() < profile["failure_rate"]:
+            raise OSError(f"Injected write failure on {profile['name']}")
+        now = time.perf_counter()
+        done = now + profile["latency"] + len(data) / profile["bandwidth"]
+        if self.medium["bandwidth"]:
+            # The access point carries one write at a time, so queue behind the others
+            with self.medium["lock"]:
+                start = max(now, self.medium["free_at"])
+                self.medium["free_at"] = start + len(data) / self.medium["bandwidth"]
+                done = max(done, self.medium["free_at"])
+        time.sleep(max(0, done - time.perf_counter()))
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+# Function to build an open() replacement that wraps files in a stand-in machine's directory
+def make_stand_in_opener(profiles_by_dir, medium):
+    def open_stand_in(path, mode="r", *args, **kwargs):
+        file = open(path, mode, *args, **kwargs)
+        profile = profiles_by_dir.get(str(Path(path).parent))
+        return StandInFile(file, profile, medium) if profile else file
+    return open_stand_in
+
+# Function to get the value at a percentile using the nearest-rank method
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def run_scenario(size_mb, machine_count, args, seed):
+    """
+    Stages one file of size_mb to each of machine_count stand-in machines in a fresh working
+    directory and returns the run's throughput, CPU time and each machine's completion time,
+    measured from the start of the stage to the end of its final attempt.
+    """
+    rng = random.Random(seed)
+    random.seed(seed)  # The engine's retry jitter
+    work_dir = Path(tempfile.mkdtemp(prefix="bench-transfer-"))
+    start_dir = os.getcwd()
+    os.chdir(work_dir)  # Keeps the engine's checkpoints, caches and telemetry out of the repo
+    try:
+        engine.digest_cache = None
+        engine.chunk_profiles = None
+        engine.chunk_probe_locks.clear()
+
+        machines = []
+        profiles_by_dir = {}
+        for machine_num in range(1, machine_count + 1):
+            dest_dir = work_dir / f"machine-{machine_num}"
+            if machine_num <= args.dead:
+                dest_dir = work_dir / f"missing-{machine_num}"  # Never created, so it fails pre-flight
+            else:
+                dest_dir.mkdir()
+            spread = 1 + rng.uniform(-args.spread, args.spread)
+            profiles_by_dir[str(dest_dir)] = {
+                "name": f"machine {machine_num}",
+                "latency": args.latency / 1000,
+                "bandwidth": args.bandwidth * spread * 1024 * 1024,
+                "failure_rate": args.failure_rate,
+                "rng": random.Random(rng.random()),
+            }
+            machines.append({"number": machine_num, "path": str(dest_dir), "row": 0, "column": machine_num - 1})
+        with open("machines.json", "w", encoding="utf-8") as f:
+            json.dump({"machines": machines}, f)
+        engine.set_machine_registry(engine.load_machine_registry(Path("machines.json")))
+
+        source_count = 1 if args.same_file else machine_count
+        files = []
+        for index in range(source_count):
+            file_path = work_dir / f"job-{index + 1}.bin"
+            with open(file_path, "wb") as f:
+                f.write(rng.randbytes(int(size_mb * 1024 * 1024)))
+            files.append(str(file_path))
+
+        medium = {"bandwidth": args.ap_bandwidth * 1024 * 1024, "lock": threading.Lock(), "free_at": 0.0}
+        engine.open_destination_file = make_stand_in_opener(profiles_by_dir, medium)
+        assignments = engine.assign_files(files, range(1, machine_count + 1), same_file=args.same_file)
+
+        cpu_start = time.process_time()
+        record = engine.stage_files(assignments, progress_interval=0.25)
+        cpu_seconds = time.process_time() - cpu_start
+    finally:
+        engine.open_destination_file = open
+        os.chdir(start_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    completed = [machine for machine in record["machines"] if machine["status"] in ("completed", "skipped")]
+    return {
+        "duration_s": record["duration_s"],
+        "mb_s": record["aggregate_mb_s"] or 0.0,
+        "sent_mb": record["sent_bytes"] / (1024 * 1024),
+        # From the stage's start to each machine's last attempt, so queueing and retries both count
+        "completion_s": [machine["finished_after_s"] for machine in completed],
+        "failed": len(record["machines"]) - len(completed),
+        "cpu_s": cpu_seconds,
+    }
+
+def summarize(size_mb, machine_count, runs, same_file=False):
+    completion = [seconds for run in runs for seconds in run["completion_s"]]
+    sent_gb = sum(run["sent_mb"] for run in runs) / 1024
+    return {
+        "scenario": f"{size_mb:g}MB x {machine_count}" + (" fan-out" if same_file else ""),
+        "size_mb": size_mb,
+        "machines": machine_count,
+        "runs": len(runs),
+        "mb_s": round(sorted(run["mb_s"] for run in runs)[len(runs) // 2], 3),
+        "p50_s": round(percentile(completion, 50), 3) if completion else None,
+        "p99_s": round(percentile(completion, 99), 3) if completion else None,
+        "cpu_s_per_gb": round(sum(run["cpu_s"] for run in runs) / sent_gb, 2) if sent_gb else None,
+        "failed": sum(run["failed"] for run in runs),
+    }
+
+# Function to list the scenarios that got slower than the baseline by more than the tolerance
+def find_regressions(results, baseline, tolerance):
+    previous = {entry["scenario"]: entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if not before:
+            continue
+        if before["mb_s"] and result["mb_s"] < before["mb_s"] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: {result['mb_s']} MB/s, was {before['mb_s']}")
+        if before["p99_s"] and result["p99_s"] and result["p99_s"] > before["p99_s"] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}: p99 {result['p99_s']} s, was {before['p99_s']}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the staging engine against local stand-in machines.")
+    parser.add_argument("--sizes", default="1,8", help="file sizes in MB, comma separated")
+    parser.add_argument("--machines", default="3,9", help="machine counts, comma separated")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario")
+    parser.add_argument("--seed", type=int, default=1, help="seed for file contents, card speeds and failures")
+    parser.add_argument("--latency", type=float, default=5.0, help="per-write latency of a card in ms")
+    parser.add_argument("--bandwidth", type=float, default=4.0, help="write bandwidth of a card in MB/s")
+    parser.add_argument("--spread", type=float, default=0.25, help="random +/- fraction applied to each card's bandwidth")
+    parser.add_argument("--ap-bandwidth", type=float, default=20.0, help="bandwidth shared by all cards in MB/s, 0 for none")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability that any write fails")
+    parser.add_argument("--dead", type=int, default=0, help="machines whose share doesn't exist")
+    parser.add_argument("--same-file", action="store_true", help="send one file to every machine (fan-out)")
+    parser.add_argument("--retry-delay", type=float, default=0.2, help="base retry backoff in seconds")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown against the baseline")
+    parser.add_argument("--verbose", action="store_true", help="log engine details to stderr")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    engine.TRANSFER_RETRY_BASE_DELAY = args.retry_delay
+    engine.AUTO_TUNE_CHUNK_SIZE = False  # Probe results would be cached across runs of a scenario
+
+    sizes = [float(size) for size in args.sizes.split(",")]
+    machine_counts = [int(count) for count in args.machines.split(",")]
+    results = []
+    # Results are only comparable between runs that simulated the same floor
+    settings = {name: getattr(args, name) for name in
+                ("seed", "latency", "bandwidth", "spread", "ap_bandwidth", "failure_rate", "dead", "retry_delay")}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            parser.error(f"{args.baseline} was recorded with different settings: {baseline['settings']}")
+
+    print(f"{'scenario':<22} {'runs':>4} {'MB/s':>8} {'p50 s':>8} {'p99 s':>8} {'CPU s/GB':>9} {'failed':>6}")
+    for size_mb in sizes:
+        for machine_count in machine_counts:
+            runs = [run_scenario(size_mb, machine_count, args, args.seed * 1000 + run) for run in range(args.repeat)]
+            result = summarize(size_mb, machine_count, runs, args.same_file)
+            results.append(result)
+            print(f"{result['scenario']:<22} {result['runs']:>4} {result['mb_s']:>8.2f} "
+                  f"{result['p50_s'] if result['p50_s'] is not None else '-':>8} "
+                  f"{result['p99_s'] if result['p99_s'] is not None else '-':>8} "
+                  f"{result['cpu_s_per_gb'] if result['cpu_s_per_gb'] is not None else '-':>9} {result['failed']:>6}",
+                  flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+
+    if baseline:
+        regressions = find_regressions(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
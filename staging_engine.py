@@ -0,0 +1,1685 @@
+# Staging engine: copies job files to the machines' shares without any UI.
+# app.py drives it from the Tk frames; it can also be imported by scripts or run headless:
+#     python staging_engine.py stage --machines 1-9 --files job1.bin job2.bin
+#     python staging_engine.py clean --machines 1-9
+
+import os
+import sys
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import shutil
+import threading
+import hashlib
+import gzip
+import json
+import logging
+import queue
+import random
+import socket
+import time
+
+# Load environment variables from .env file
+load_dotenv()
+
+# ---- Machine registry: every machine's host, share, grid position and enabled flag ----
+
+MACHINE_REGISTRY_FILE = Path("machines.json")
+
+def load_machine_registry(path=MACHINE_REGISTRY_FILE):
+    """
+    Loads the floor from a JSON file of the form
+    {"share": "DavWWWRoot", "machines": [{"number": 1, "host": "192.168.68.81", "row": 8, "column": 0, "enabled": true}, ...]}
+    and returns a dict of machine number -> entry. A machine may override "share"; machines
+    without a host have no destination and can't be staged. A "path" replaces the share with
+    any directory, such as a local stand-in for testing. "compression": "gzip" marks a
+    destination with a helper that expands uploaded <name>.gz files into <name>.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    registry = {}
+    for machine in config["machines"]:
+        number = int(machine["number"])
+        if number in registry:
+            raise ValueError(f"Machine {number} is listed twice in {path}.")
+        host = machine.get("host")
+        machine_path = machine.get("path")
+        share = machine.get("share", config.get("share", "DavWWWRoot"))
+        compression = machine.get("compression")
+        if compression not in (None, "gzip"):
+            raise ValueError(f"Machine {number} has unknown compression {compression!r} in {path}.")
+        registry[number] = {
+            "number": number,
+            "host": host,
+            "share": share,
+            "row": int(machine["row"]),
+            "column": int(machine["column"]),
+            "enabled": bool(machine.get("enabled", True)) and bool(host or machine_path),
+            "destination": Path(machine_path) if machine_path else Path(f"\\\\{host}\\{share}") if host else None,
+            "compression": compression,
+        }
+    return registry
+
+# Loaded from MACHINE_REGISTRY_FILE when it exists; scripts can swap in another with set_machine_registry
+machine_registry = load_machine_registry() if MACHINE_REGISTRY_FILE.exists() else {}
+
+# Function to switch to another registry, e.g. another floor or local stand-in destinations
+def set_machine_registry(registry):
+    machine_registry.clear()  # Updated in place so modules that imported it see the change
+    machine_registry.update(registry)
+
+# Function to get a machine's destination share, or None if it has none
+def get_destination_directory(machine_num):
+    machine = machine_registry.get(machine_num)
+    return machine["destination"] if machine else None
+
+# Function to check whether a machine can be selected for staging
+def is_machine_enabled(machine_num):
+    machine = machine_registry.get(machine_num)
+    return bool(machine and machine["enabled"])
+
+# Transfer settings
+TRANSFER_CHUNK_SIZE = 1024 * 1024               # Bytes per chunk when a destination has no tuned size
+AUTO_TUNE_CHUNK_SIZE = True                     # Probe each destination host for its fastest chunk size
+CHUNK_SIZE_CANDIDATES = (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+CHUNK_PROBE_BYTES = 4 * 1024 * 1024             # Bytes written per candidate while probing
+CHUNK_PROFILE_FILE = Path("chunk_profiles.json")  # Winning chunk size per destination host
+CHUNK_PROFILE_MAX_AGE = 7 * 24 * 60 * 60        # Seconds before a host is probed again
+RESUMABLE_TRANSFERS = True                      # Continue interrupted copies from the last verified chunk
+CHECKPOINT_DIR = Path("transfer_checkpoints")   # Local per-(machine, file) checkpoints
+CHECKPOINT_VERIFY_CHUNKS = 3                    # Confirmed chunks to check before restarting from zero
+CHECKPOINT_SAVE_BYTES = 8 * 1024 * 1024         # Bytes written between checkpoint saves...
+CHECKPOINT_SAVE_SECONDS = 1.0                   # ...or seconds, whichever comes first
+SKIP_IDENTICAL_FILES = True                     # Don't re-send files the destination already has
+REMOTE_DIGEST_CHECK = True                      # Hash same-sized destination files with no cached fingerprint
+DIGEST_CACHE_FILE = Path("digest_cache.json")   # Local cache of source digests and destination fingerprints
+FAN_OUT_TRANSFERS = True                        # Share each read of a file among a group of the machines it goes to
+FAN_OUT_BUFFER_CHUNKS = 8                       # Chunks the reader may run ahead of the slowest machine
+MAX_CONCURRENT_TRANSFERS = 12                   # Upper bound for the adaptive global transfer limit
+MIN_CONCURRENT_TRANSFERS = 2                    # Lower bound for the adaptive global transfer limit
+INITIAL_CONCURRENT_TRANSFERS = 4                # Global limit a stage starts with
+MAX_TRANSFERS_PER_HOST = 1                      # Simultaneous writes to one SD-WiFi card
+MAX_TRANSFERS_PER_SUBNET = 8                    # Simultaneous writes through one /24 (one access point)
+CONCURRENCY_SAMPLE_INTERVAL = 2.0               # Seconds between throughput samples
+CONCURRENCY_TOLERANCE = 0.05                    # Relative throughput change treated as noise
+TELEMETRY_SAMPLE_SECONDS = 1.0                  # Window for the instantaneous throughput figure
+TELEMETRY_SMOOTHING = 0.3                       # Weight of the newest sample in the moving average
+TELEMETRY_EXPORT_FILE = Path("transfer_telemetry.jsonl")  # One JSON record appended per run
+TRANSFER_MAX_ATTEMPTS = 3                       # Attempts per (machine, file) before it's left for a manual retry
+TRANSFER_RETRY_BASE_DELAY = 2.0                 # Seconds before the first automatic retry
+TRANSFER_RETRY_MAX_DELAY = 30.0                 # Upper bound for the retry backoff in seconds
+TEMP_FILE_SUFFIX = ".part"                      # Files are written as <name>.part and renamed once verified
+VERIFY_BEFORE_RENAME = "size"                   # "size", or "checksum" to also read the file back and hash it
+COMPRESS_TRANSFERS = True                       # Send gzip to destinations whose registry entry has a decompress helper
+COMPRESSION_CACHE_DIR = Path("compression_cache")  # Compressed copies of sources, reused for repeat files
+COMPRESSION_LEVEL = 6                           # gzip level; compressing locally is far faster than the Wi-Fi link
+COMPRESSION_MIN_BYTES = 256 * 1024              # Smaller files are sent as they are
+COMPRESSION_MIN_SAVING = 0.1                    # Send raw unless gzip saves at least this fraction
+PREFLIGHT_CHECKS = True                         # Probe every destination before any transfer starts
+PREFLIGHT_TIMEOUT = 3.0                         # Seconds each reachability and share check may take
+PREFLIGHT_PORT = 80                             # WebDAV port the SD-WiFi cards serve DavWWWRoot on
+PREFLIGHT_PROBE_BYTES = 4096                    # Bytes written to time a destination's write latency
+PREFLIGHT_SLOW_WRITE_MS = 1000                  # Probe writes slower than this flag the share as slow
+
+STATION_ID = os.getenv("STATION_ID") or socket.gethostname()  # Names this station on claims and probe files
+
+fileErrors = {}  # Dictionary to store machine_num as keys and failed file names as values
+
+# Opens files for writing on destination shares; benchmarks swap in a throttled stand-in with the same signature
+open_destination_file = open
+
+# Function to get the checkpoint file for a machine/source file pair
+def get_checkpoint_path(machine_num, src_path):
+    key = hashlib.sha1(os.path.abspath(src_path).encode("utf-8")).hexdigest()[:16]
+    return CHECKPOINT_DIR / f"machine-{machine_num}-{key}.json"
+
+# Function to create an empty checkpoint for a new transfer
+def new_checkpoint(src_path, dest_path, chunk_size):
+    stat = os.stat(src_path)
+    return {
+        "source": os.path.abspath(src_path),
+        "destination": str(dest_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "chunk_size": chunk_size,
+        "confirmed": 0,   # Bytes written and flushed to the destination
+        "first_chunk": 0, # Index of the first chunk in "chunks"
+        "chunks": [],     # SHA-256 of the last CHECKPOINT_VERIFY_CHUNKS confirmed chunks
+    }
+
+# Function to load a checkpoint, ignoring it if the source, destination or required chunk size has changed
+def load_checkpoint(checkpoint_path, src_path, dest_path, chunk_size=None):
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable checkpoint {checkpoint_path}: {e}")
+        return None
+
+    expected = new_checkpoint(src_path, dest_path, chunk_size)
+    fields = ["source", "destination", "size", "mtime_ns"]
+    if chunk_size is not None:
+        fields.append("chunk_size")
+    for field in fields:
+        if checkpoint.get(field) != expected[field]:
+            logging.info(f"Discarding stale checkpoint {checkpoint_path} ({field} changed).")
+            return None
+    checkpoint.setdefault("first_chunk", 0)  # Older checkpoints list every chunk's hash
+    return checkpoint
+
+# Function to write a checkpoint atomically so a crash never leaves it half-written
+def save_checkpoint(checkpoint_path, checkpoint):
+    CHECKPOINT_DIR.mkdir(exist_ok=True)
+    tmp_path = checkpoint_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+# Function to remove a checkpoint once its transfer has completed
+def clear_checkpoint(checkpoint_path):
+    try:
+        os.remove(checkpoint_path)
+    except FileNotFoundError:
+        pass
+
+# Function to get the temporary name a destination file is written under until it's complete
+def get_temp_path(dest_path):
+    return dest_path.with_name(dest_path.name + TEMP_FILE_SUFFIX)
+
+# Function to delete leftover temporary files from earlier interrupted runs
+def remove_stale_temp_files(machine_num, dest_dir, keep_names=()):
+    """
+    Removes every *.part file in `dest_dir` except the temporary files of `keep_names`, which
+    may still be resumed by the transfer about to start. Returns the number of files removed.
+    """
+    keep = {name + TEMP_FILE_SUFFIX for name in keep_names}
+    removed = 0
+    for temp_path in dest_dir.glob("*" + TEMP_FILE_SUFFIX):
+        if temp_path.name in keep:
+            continue
+        try:
+            os.remove(temp_path)
+            removed += 1
+        except OSError as e:
+            logging.warning(f"Couldn't remove stale {temp_path.name} from Machine {machine_num}: {e}")
+    if removed:
+        logging.info(f"Removed {removed} stale temporary file(s) from Machine {machine_num}.")
+    return removed
+
+# Function to find the offset a transfer can safely resume from
+def verify_checkpoint(checkpoint, dest_path):
+    """
+    Reads back the last confirmed chunks from the destination and compares their hashes
+    with the checkpoint. Returns the end offset of the newest chunk that still matches,
+    or 0 if none of the checked chunks match and the copy must start over.
+    """
+    chunk_size = checkpoint["chunk_size"]
+    chunks = checkpoint["chunks"]
+    try:
+        dest_size = os.path.getsize(dest_path)
+    except OSError:
+        return 0
+
+    with open(dest_path, "rb") as dest:
+        for position in range(len(chunks) - 1, max(-1, len(chunks) - 1 - CHECKPOINT_VERIFY_CHUNKS), -1):
+            start = (checkpoint["first_chunk"] + position) * chunk_size
+            end = min(start + chunk_size, checkpoint["size"])
+            if dest_size < end:
+                continue
+            dest.seek(start)
+            if hashlib.sha256(dest.read(end - start)).hexdigest() == chunks[position]:
+                return end
+    return 0
+
+# Source digests keyed by path/size/mtime and fingerprints of files we've written to each machine
+digest_cache = None
+digest_cache_lock = threading.Lock()
+
+# Function to load the digest cache from disk the first time it's needed
+def get_digest_cache():
+    global digest_cache
+    with digest_cache_lock:
+        if digest_cache is None:
+            try:
+                with open(DIGEST_CACHE_FILE, "r", encoding="utf-8") as f:
+                    digest_cache = json.load(f)
+            except FileNotFoundError:
+                digest_cache = {}
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable digest cache {DIGEST_CACHE_FILE}: {e}")
+                digest_cache = {}
+            digest_cache.setdefault("sources", {})
+            digest_cache.setdefault("destinations", {})
+        return digest_cache
+
+# Function to persist the digest cache
+def save_digest_cache():
+    with digest_cache_lock:
+        data = json.dumps(digest_cache)
+        tmp_path = DIGEST_CACHE_FILE.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, DIGEST_CACHE_FILE)
+
+# Function to hash a file in chunks
+def compute_file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(TRANSFER_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to get a source file's digest, hashing it only when path, size or mtime changed
+def get_source_digest(src_path):
+    cache = get_digest_cache()
+    stat = os.stat(src_path)
+    key = f"{os.path.abspath(src_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    with digest_cache_lock:
+        digest = cache["sources"].get(key)
+    if digest is None:
+        digest = compute_file_digest(src_path)
+        with digest_cache_lock:
+            cache["sources"][key] = digest
+        save_digest_cache()
+    return digest
+
+# Function to remember what a destination file contains after we've written or verified it
+def record_destination_fingerprint(machine_num, dest_path, digest):
+    cache = get_digest_cache()
+    stat = os.stat(dest_path)
+    with digest_cache_lock:
+        cache["destinations"][f"{machine_num}|{dest_path}"] = {
+            "digest": digest,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+    save_digest_cache()
+
+# Function to drop a destination file's fingerprint once the file has been deleted
+def forget_destination_fingerprint(machine_num, dest_path):
+    cache = get_digest_cache()
+    with digest_cache_lock:
+        removed = cache["destinations"].pop(f"{machine_num}|{dest_path}", None)
+    if removed:
+        save_digest_cache()
+
+# Function to check whether the destination already holds an identical copy of the source
+def is_destination_identical(src_path, dest_path, machine_num):
+    try:
+        dest_stat = os.stat(dest_path)
+    except OSError:
+        return False  # Nothing there yet
+    if dest_stat.st_size != os.path.getsize(src_path):
+        return False
+
+    src_digest = get_source_digest(src_path)
+    cache = get_digest_cache()
+    with digest_cache_lock:
+        fingerprint = cache["destinations"].get(f"{machine_num}|{dest_path}")
+    if (fingerprint and fingerprint["size"] == dest_stat.st_size
+            and fingerprint["mtime_ns"] == dest_stat.st_mtime_ns):
+        # Destination hasn't been touched since we last saw it, so its cached digest still holds
+        return fingerprint["digest"] == src_digest
+    if not REMOTE_DIGEST_CHECK:
+        return False
+
+    # Same size but unknown contents: reading it back is cheaper than re-sending over Wi-Fi
+    dest_digest = compute_file_digest(dest_path)
+    record_destination_fingerprint(machine_num, dest_path, dest_digest)
+    return dest_digest == src_digest
+
+# Tuned chunk sizes keyed by destination host
+chunk_profiles = None
+chunk_profiles_lock = threading.Lock()
+chunk_probe_locks = {}  # host -> lock, so concurrent transfers to one host probe it only once
+
+# Function to load the per-host chunk size profiles from disk the first time they're needed
+def get_chunk_profiles():
+    global chunk_profiles
+    with chunk_profiles_lock:
+        if chunk_profiles is None:
+            try:
+                with open(CHUNK_PROFILE_FILE, "r", encoding="utf-8") as f:
+                    chunk_profiles = json.load(f)
+            except FileNotFoundError:
+                chunk_profiles = {}
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable chunk profiles {CHUNK_PROFILE_FILE}: {e}")
+                chunk_profiles = {}
+        return chunk_profiles
+
+# Function to persist the per-host chunk size profiles
+def save_chunk_profiles():
+    with chunk_profiles_lock:
+        data = json.dumps(chunk_profiles, indent=2)
+        tmp_path = CHUNK_PROFILE_FILE.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, CHUNK_PROFILE_FILE)
+
+def probe_chunk_sizes(dest_dir):
+    """
+    Writes CHUNK_PROBE_BYTES to a scratch file on the share at each candidate chunk size and
+    returns ({chunk_size: MB/s}, fastest chunk size).
+    """
+    probe_path = dest_dir / ".chunk-probe.tmp"
+    results = {}
+    try:
+        for chunk_size in CHUNK_SIZE_CANDIDATES:
+            chunk = bytes(chunk_size)
+            start = time.perf_counter()
+            with open_destination_file(probe_path, "wb") as probe:
+                for _ in range(max(1, CHUNK_PROBE_BYTES // chunk_size)):
+                    probe.write(chunk)
+            elapsed = time.perf_counter() - start
+            results[chunk_size] = max(CHUNK_PROBE_BYTES, chunk_size) / elapsed / (1024 * 1024)
+    finally:
+        try:
+            os.remove(probe_path)
+        except OSError:
+            pass
+    return results, max(results, key=results.get)
+
+# Function to get the chunk size to use for a destination, probing its host if needed
+def get_chunk_size(dest_dir):
+    if not AUTO_TUNE_CHUNK_SIZE:
+        return TRANSFER_CHUNK_SIZE
+    host = get_destination_host(dest_dir)
+    with chunk_profiles_lock:
+        probe_lock = chunk_probe_locks.setdefault(host, threading.Lock())
+
+    with probe_lock:
+        profile = get_chunk_profiles().get(host)
+        if profile and time.time() - profile["probed_at"] < CHUNK_PROFILE_MAX_AGE:
+            return profile["chunk_size"]
+        try:
+            results, best = probe_chunk_sizes(dest_dir)
+        except Exception as e:
+            logging.warning(f"Chunk size probe failed for {host}, using {TRANSFER_CHUNK_SIZE} bytes: {e}")
+            return profile["chunk_size"] if profile else TRANSFER_CHUNK_SIZE
+
+        logging.info(f"Tuned chunk size for {host}: {best} bytes "
+                     f"({', '.join(f'{size // 1024} KiB {rate:.2f} MB/s' for size, rate in results.items())}).")
+        with chunk_profiles_lock:
+            chunk_profiles[host] = {
+                "chunk_size": best,
+                "probed_at": time.time(),
+                "throughput_mb_s": {str(size): round(rate, 3) for size, rate in results.items()},
+            }
+        save_chunk_profiles()
+        return best
+
+# ---- Compressed transfers for destinations with a decompress helper ----
+# The SD-WiFi cards can only take the raw .bin, so they never get compressed data. A destination
+# whose registry entry says "compression": "gzip" runs a helper that expands <name>.gz, and gets
+# a gzip copy built once per source in COMPRESSION_CACHE_DIR. That copy goes through the normal
+# engine, so resume, verification and the atomic rename all work on the compressed bytes.
+
+compression_locks = {}  # Source digest -> lock, so a file is only compressed once at a time
+compression_locks_lock = threading.Lock()
+
+def get_compressed_source(src_path):
+    """
+    Returns the path of a cached gzip copy of `src_path` named <name>.gz, building it with a
+    streaming compressor if it isn't cached yet, or None if the file is too small or doesn't
+    compress by at least COMPRESSION_MIN_SAVING. Both outcomes are cached by source digest, so a
+    repeat file costs no compression work.
+    """
+    size = os.path.getsize(src_path)
+    if size < COMPRESSION_MIN_BYTES:
+        return None
+    digest = get_source_digest(src_path)
+    cache_dir = COMPRESSION_CACHE_DIR / digest
+    compressed_path = cache_dir / (Path(src_path).name + ".gz")
+    incompressible_marker = cache_dir / "incompressible"
+
+    with compression_locks_lock:
+        lock = compression_locks.setdefault(digest, threading.Lock())
+    with lock:
+        if compressed_path.exists():
+            return compressed_path
+        if incompressible_marker.exists():
+            return None
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = compressed_path.with_name(compressed_path.name + ".tmp")
+        start = time.perf_counter()
+        with open(src_path, "rb") as src, open(tmp_path, "wb") as raw:
+            # mtime=0 keeps the output identical for identical input, so resumes stay valid
+            with gzip.GzipFile(filename=Path(src_path).name, mode="wb", compresslevel=COMPRESSION_LEVEL,
+                               fileobj=raw, mtime=0) as compressed:
+                while chunk := src.read(TRANSFER_CHUNK_SIZE):
+                    compressed.write(chunk)
+        compressed_size = os.path.getsize(tmp_path)
+        if compressed_size > size * (1 - COMPRESSION_MIN_SAVING):
+            os.remove(tmp_path)
+            incompressible_marker.touch()
+            logging.info(f"{Path(src_path).name} only compresses to {compressed_size / size:.0%}; sending it raw.")
+            return None
+        os.replace(tmp_path, compressed_path)
+        logging.info(f"Compressed {Path(src_path).name} to {compressed_size / size:.0%} of {size} bytes "
+                     f"in {time.perf_counter() - start:.2f} s.")
+        return compressed_path
+
+def use_compressed_sources(files_by_machine):
+    """
+    Swaps each file bound for a destination with a decompress helper for its cached gzip copy.
+    Distinct sources are compressed in parallel before any transfer starts. A file that can't
+    be compressed is sent as it is.
+    """
+    helper_machines = [machine_num for machine_num in files_by_machine
+                       if machine_num in machine_registry and machine_registry[machine_num]["compression"] == "gzip"]
+    sources = {file_path for machine_num in helper_machines for file_path in files_by_machine[machine_num]
+               if COMPRESSION_CACHE_DIR.resolve() not in Path(file_path).resolve().parents}  # Retries are already compressed
+    if not sources:
+        return files_by_machine
+
+    def compress(file_path):
+        try:
+            return file_path, get_compressed_source(file_path)
+        except Exception as e:
+            logging.warning(f"Couldn't compress {os.path.basename(file_path)}, sending it raw: {e}")
+            return file_path, None
+
+    with ThreadPoolExecutor(max_workers=min(len(sources), os.cpu_count() or 1)) as executor:
+        compressed = {file_path: str(path) for file_path, path in executor.map(compress, sources) if path}
+
+    files_by_machine = dict(files_by_machine)
+    for machine_num in helper_machines:
+        files_by_machine[machine_num] = [compressed.get(file_path, file_path) for file_path in files_by_machine[machine_num]]
+    return files_by_machine
+
+# (machine_num, file_path) pairs that failed in the current pass, and the ones left after the last run
+failed_transfers = []
+failed_transfers_lock = threading.Lock()
+retryable_transfers = []
+
+# Function to remember a failed pair so it can be retried
+def record_failed_transfer(machine_num, src_path):
+    with failed_transfers_lock:
+        if (machine_num, src_path) not in failed_transfers:
+            failed_transfers.append((machine_num, src_path))
+
+# ---- Pre-flight checks: find dead, full or slow destinations before the batch starts ----
+
+# Function to clear a share's stale temp files and measure its usable space and write latency;
+# may block for a long time on a dead share
+def check_destination_share(machine_num, dest_dir, files, cleanup_first=False):
+    names = {Path(file_path).name for file_path in files}
+    remove_stale_temp_files(machine_num, dest_dir, keep_names=names)
+    available = shutil.disk_usage(dest_dir).free
+    for name in names:
+        # A file that will be overwritten frees its space; a partial copy only needs the rest
+        for existing in (dest_dir / name, get_temp_path(dest_dir / name)):
+            try:
+                available += existing.stat().st_size
+            except FileNotFoundError:
+                pass
+    if cleanup_first:
+        # So do the old .bin files the cleanup before upload is about to delete
+        for existing in dest_dir.glob("*.bin"):
+            if existing.name not in names:
+                try:
+                    available += existing.stat().st_size
+                except FileNotFoundError:
+                    pass
+
+    probe_path = dest_dir / f".preflight-{STATION_ID}.tmp"
+    start = time.perf_counter()
+    try:
+        with open_destination_file(probe_path, "wb") as probe:
+            probe.write(os.urandom(PREFLIGHT_PROBE_BYTES))
+        write_ms = (time.perf_counter() - start) * 1000
+    finally:
+        try:
+            os.remove(probe_path)
+        except OSError:
+            pass
+    return available, write_ms
+
+def probe_destination(machine_num, dest_dir, files, cleanup_first=False):
+    """
+    Checks one destination with tight timeouts: that its host accepts a connection, that the
+    share has room for `files` (counting the .bin files a cleanup before upload will delete)
+    and how long a small write takes. The share checks run on a daemon thread, so a share that
+    hangs is abandoned after PREFLIGHT_TIMEOUT instead of holding up the batch or the
+    interpreter's exit. Returns a result dict whose status is "ok", "slow", "low_space",
+    "unreachable" or "error".
+    """
+    result = {"machine": machine_num, "status": "ok", "free_bytes": None, "write_ms": None, "error": None}
+
+    # A TCP connect fails in milliseconds where the WebDAV redirector would wait out its own timeout
+    if str(dest_dir).startswith("\\\\"):
+        host = get_destination_host(dest_dir)
+        try:
+            socket.create_connection((host, PREFLIGHT_PORT), timeout=PREFLIGHT_TIMEOUT).close()
+        except OSError as e:
+            result.update(status="unreachable", error=f"{host} is not reachable: {e}")
+            return result
+
+    share_check = {}
+
+    def check_share():
+        try:
+            share_check["result"] = check_destination_share(machine_num, dest_dir, files, cleanup_first)
+        except Exception as e:
+            share_check["error"] = e
+
+    share_thread = threading.Thread(target=check_share, daemon=True)
+    share_thread.start()
+    share_thread.join(PREFLIGHT_TIMEOUT)
+    if share_thread.is_alive():
+        result.update(status="unreachable", error=f"{dest_dir} did not respond within {PREFLIGHT_TIMEOUT:g} s")
+        return result
+    if "error" in share_check:
+        result.update(status="error", error=f"{dest_dir} could not be checked: {share_check['error']}")
+        return result
+    result["free_bytes"], result["write_ms"] = share_check["result"]
+
+    required = 0
+    for file_path in files:
+        try:
+            required += os.path.getsize(file_path)
+        except OSError:
+            pass  # The transfer reports the missing file
+    if result["free_bytes"] < required:
+        result.update(status="low_space", error=f"{dest_dir} has {result['free_bytes'] / (1024 * 1024):.1f} MB free "
+                                                f"but needs {required / (1024 * 1024):.1f} MB")
+    elif result["write_ms"] > PREFLIGHT_SLOW_WRITE_MS:
+        result["status"] = "slow"
+    return result
+
+def run_preflight_checks(files_by_machine, progress_slots, cleanup_first=False):
+    """
+    Probes every destination in `files_by_machine` (machine_num -> file paths) in parallel and
+    returns it without the machines that are unreachable, full or failed their checks. Those
+    machines are marked failed right away; slow ones are kept and flagged in their telemetry.
+    With cleanup_first, space held by the .bin files about to be cleaned counts as free.
+    """
+    targets = [(machine_num, get_destination_directory(machine_num), files)
+               for machine_num, files in files_by_machine.items()
+               if files and get_destination_directory(machine_num) is not None]
+    if not targets:
+        return files_by_machine
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        results = list(executor.map(lambda target: probe_destination(*target, cleanup_first), targets))
+
+    healthy = dict(files_by_machine)
+    for result in results:
+        machine_num = result["machine"]
+        record_telemetry(machine_num, preflight=result["status"], preflight_write_ms=result["write_ms"])
+        if result["status"] == "slow":
+            logging.warning(f"Machine {machine_num} share is slow: a {PREFLIGHT_PROBE_BYTES} byte write "
+                            f"took {result['write_ms']:.0f} ms.")
+        elif result["status"] != "ok":
+            logging.error(f"Pre-flight check failed for Machine {machine_num}: {result['error']}")
+            report_preflight_failure(machine_num, healthy.pop(machine_num), progress_slots, result["error"])
+    logging.info(f"Pre-flight checked {len(targets)} destination(s) in {time.perf_counter() - start:.2f} s; "
+                 f"{len(targets) - (len(files_by_machine) - len(healthy))} usable.")
+    return healthy
+
+# Function to mark a machine that failed its pre-flight check without attempting any of its files
+def report_preflight_failure(machine_num, files, progress_slots, error):
+    report_progress(progress_slots, machine_num, -1)
+    record_telemetry(machine_num, started=time.time(), finished=time.time(), status="failed", error=error)
+    fileErrors[machine_num] = ", ".join(os.path.basename(file_path) for file_path in files)
+    for file_path in files:
+        record_failed_transfer(machine_num, file_path)
+
+# Function to publish a machine's latest progress; only the newest value per machine is kept
+def report_progress(progress_slots, machine_num, progress):
+    if progress_slots.get(machine_num) == -1:
+        return  # A failed file stays visible even if the machine's later waves succeed
+    progress_slots[machine_num] = get_wave_progress(machine_num, progress)  # A single dict store, atomic under the GIL
+
+# Wave state for machines staging several files in this run; each entry is only changed by its
+# machine's own wave thread
+machine_waves = {}
+
+# Function to start the wave state for a machine's planned files
+def new_machine_waves(files):
+    sizes = []
+    for file_path in files:
+        try:
+            sizes.append(os.path.getsize(file_path))
+        except OSError:
+            sizes.append(0)
+    return {
+        "sizes": sizes,
+        "index": 0,               # Wave being copied
+        "done_bytes": 0,          # Bytes in the waves before it
+        "total_bytes": sum(sizes),
+        "skipped": 0,             # Waves the destination already had
+        "errors": [],
+    }
+
+# Function to turn one file's progress into progress through the machine's whole bin
+def get_wave_progress(machine_num, progress):
+    waves = machine_waves.get(machine_num)
+    if waves is None or progress == -1 or not waves["total_bytes"]:
+        return progress
+    current_bytes = waves["sizes"][waves["index"]]
+    return min(1.0, (waves["done_bytes"] + progress * current_bytes) / waves["total_bytes"])
+
+# Function to turn one file's telemetry fields into fields for the machine's whole bin
+def get_wave_telemetry(machine_num, fields):
+    waves = machine_waves.get(machine_num)
+    if waves is None:
+        return fields
+    fields = dict(fields, wave=waves["index"] + 1)
+    if "total" in fields:
+        fields["total"] = waves["total_bytes"]
+    if "copied" in fields:
+        fields["copied"] += waves["done_bytes"]
+    if waves["index"] > 0:
+        fields.pop("started", None)
+
+    status = fields.get("status")
+    if status == "skipped":
+        waves["skipped"] += 1
+    elif status == "failed":
+        waves["errors"].append(fields["error"])
+    if status in (None, "preparing", "transferring"):
+        if status == "preparing" and waves["index"] > 0:
+            fields["status"] = "transferring"  # Still the same machine run
+        return fields
+
+    if waves["index"] < len(waves["sizes"]) - 1:
+        # Only the last wave ends the machine's run
+        fields["status"] = "transferring"
+        fields.pop("finished", None)
+    elif waves["errors"]:
+        fields["status"], fields["error"] = "failed", waves["errors"][0]
+    elif status in ("completed", "skipped"):
+        fields["status"] = "skipped" if waves["skipped"] == len(waves["sizes"]) else "completed"
+    return fields
+
+def run_machine_waves(machine_num, dest_dir, files, progress_slots, cleanup_first=False):
+    """
+    Copies a machine's planned files one after another. Each file waits for its own scheduler
+    slot, so between waves the machine doesn't hold a slot another transfer could use. A
+    failed file is reported and the machine moves on to its next one.
+    """
+    waves = machine_waves[machine_num]
+    if cleanup_first:
+        delete_bin_files_on_machine(machine_num, dest_dir, keep={Path(file_path).name for file_path in files})
+    for index, file_path in enumerate(files):
+        waves["index"] = index
+        run_scheduled_transfer([get_destination_host(dest_dir)], copy_file, file_path, dest_dir, machine_num, progress_slots)
+        waves["done_bytes"] += waves["sizes"][index]
+
+# Telemetry for the transfer run in progress
+transfer_telemetry = None
+telemetry_lock = threading.Lock()
+
+# Function to start collecting telemetry for a new run
+def start_transfer_telemetry(file_assignments):
+    global transfer_telemetry
+    now = time.time()
+    with telemetry_lock:
+        transfer_telemetry = {
+            "run_id": time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),
+            "started": now,
+            "finished": None,
+            "machines": {},
+        }
+        for machine_num, file_path in file_assignments:
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                size = 0
+            entry = transfer_telemetry["machines"].get(machine_num)
+            if entry is not None:
+                # A machine staging several files gets one entry covering all of them
+                entry["file"] += f", {os.path.basename(file_path)}"
+                entry["total"] += size
+                entry["waves"] += 1
+                continue
+            transfer_telemetry["machines"][machine_num] = {
+                "file": os.path.basename(file_path),
+                "total": size,         # Known up front so queued machines count towards what's left
+                "copied": 0,           # Bytes present on the destination, including resumed ones
+                "sent": 0,             # Bytes written during this run
+                "started": None,
+                "first_byte": None,
+                "finished": None,
+                "status": "queued",
+                "error": None,
+                "rate": 0.0,           # Instantaneous bytes/s over the last sample window
+                "avg_rate": None,      # Moving average bytes/s
+                "peak_rate": 0.0,
+                "sample_time": None,
+                "sample_sent": 0,
+                "final_sampled": False,  # Set once the last sample after the transfer ended is taken
+                "wave": 1,             # File of the machine's bin being copied
+                "waves": 1,
+                "preflight": None,     # Pre-flight status: ok, slow, low_space, unreachable or error
+                "preflight_write_ms": None,
+                "attempts": 1,
+            }
+    return transfer_telemetry
+
+# Function to update a machine's telemetry from a transfer worker
+def record_telemetry(machine_num, **fields):
+    fields = get_wave_telemetry(machine_num, fields)
+    with telemetry_lock:
+        if transfer_telemetry and machine_num in transfer_telemetry["machines"]:
+            entry = transfer_telemetry["machines"][machine_num]
+            if entry["started"] is not None:
+                fields.pop("started", None)  # A machine's timings run from its first attempt
+            if "sent" in fields:
+                fields["sent"] += entry["sent"]
+                if entry["first_byte"] is None:
+                    entry["first_byte"] = time.time()
+            entry.update(fields)
+
+# Function to refresh the throughput figures; called by the UI once per frame
+def sample_transfer_telemetry(telemetry, now):
+    with telemetry_lock:
+        for entry in telemetry["machines"].values():
+            if entry["first_byte"] is None or entry["final_sampled"]:
+                continue
+            if entry["sample_time"] is None:
+                entry["sample_time"], entry["sample_sent"] = entry["first_byte"], 0
+            elapsed = now - entry["sample_time"]
+            if entry["status"] == "transferring" and elapsed < TELEMETRY_SAMPLE_SECONDS:
+                continue
+            if elapsed <= 0:
+                continue
+            entry["rate"] = (entry["sent"] - entry["sample_sent"]) / elapsed
+            entry["peak_rate"] = max(entry["peak_rate"], entry["rate"])
+            if entry["avg_rate"] is None:
+                entry["avg_rate"] = entry["rate"]
+            else:
+                entry["avg_rate"] += TELEMETRY_SMOOTHING * (entry["rate"] - entry["avg_rate"])
+            entry["sample_time"], entry["sample_sent"] = now, entry["sent"]
+            if entry["status"] != "transferring":
+                entry["rate"] = 0.0
+                entry["final_sampled"] = True
+
+# Function to format a byte rate for display
+def format_rate(bytes_per_second):
+    return f"{bytes_per_second / (1024 * 1024):.2f} MB/s" if bytes_per_second >= 1024 * 1024 \
+        else f"{bytes_per_second / 1024:.0f} KB/s"
+
+# Function to format a number of seconds as m:ss
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+# Function to estimate seconds left for one machine, or None while there's no rate yet; a machine
+# that hasn't started is estimated at queued_rate, usually the average of the machines that have
+def get_machine_eta(entry, queued_rate=None):
+    if entry["status"] in ("completed", "skipped"):
+        return 0
+    if entry["status"] in ("queued", "preparing"):
+        rate = queued_rate
+    elif entry["status"] == "transferring":
+        rate = entry["avg_rate"] or queued_rate
+    else:
+        return None
+    if not rate:
+        return None
+    return max(0, entry["total"] - entry["copied"]) / rate
+
+# Function to describe one machine's transfer for its progress label
+def describe_machine_telemetry(machine_num, entry):
+    text = f"Machine {machine_num} File Transfer Progress:"
+    if entry["waves"] > 1:
+        text = f"Machine {machine_num} File Transfer Progress (file {entry['wave']} of {entry['waves']}):"
+    if entry["attempts"] > 1:
+        text += f"  attempt {entry['attempts']} of {TRANSFER_MAX_ATTEMPTS}"
+    if entry["status"] == "failed" and entry["first_byte"] is None and entry["preflight"] not in (None, "ok", "slow"):
+        return text + f" skipped, {entry['error']}"
+    if entry["preflight"] == "slow":
+        text += "  [slow share]"
+    if entry["status"] == "skipped":
+        return text + " already up to date"
+    if entry["first_byte"] is None:
+        return text
+    ttfb_ms = (entry["first_byte"] - entry["started"]) * 1000
+    text += f"  {format_rate(entry['rate'])}"
+    if entry["avg_rate"] is not None:
+        text += f" (avg {format_rate(entry['avg_rate'])})"
+    if entry["status"] == "transferring":
+        text += f"  ETA {format_eta(get_machine_eta(entry))}"
+    return text + f"  TTFB {ttfb_ms:.0f} ms"
+
+# Function to summarize the whole run for the aggregate label
+def describe_run_telemetry(telemetry):
+    with telemetry_lock:
+        entries = list(telemetry["machines"].values())
+    active = [entry for entry in entries if entry["status"] == "transferring"]
+    aggregate_rate = sum(entry["rate"] for entry in active)
+    pending = [entry for entry in entries if entry["status"] in ("queued", "preparing", "transferring")]
+    remaining = sum(max(0, entry["total"] - entry["copied"]) for entry in pending)
+    rates = [entry["avg_rate"] for entry in entries if entry["avg_rate"]]
+    average_rate = sum(rates) / len(rates) if rates else None
+    # The stage finishes when its slowest machine does, and no sooner than its throughput so far
+    # gets through everything that's left, queued machines included
+    etas = [get_machine_eta(entry, average_rate) for entry in pending]
+    eta = None if not etas or None in etas else max(etas)
+    elapsed = time.time() - telemetry["started"]
+    sent = sum(entry["sent"] for entry in entries)
+    if eta is not None and sent and elapsed > 0:
+        eta = max(eta, remaining / (sent / elapsed))
+    done = sum(1 for entry in entries if entry["status"] in ("completed", "skipped", "failed"))
+    return (f"{done}/{len(entries)} done  |  {format_rate(aggregate_rate)} total  |  "
+            f"{remaining / (1024 * 1024):.1f} MB left  |  ETA {format_eta(eta)}")
+
+def export_transfer_telemetry(telemetry):
+    """
+    Appends one structured record for the finished run to TELEMETRY_EXPORT_FILE and logs the
+    slowest machine, which is usually the one holding up the stage.
+    """
+    with telemetry_lock:
+        telemetry["finished"] = time.time()
+        machines = []
+        for machine_num, entry in sorted(telemetry["machines"].items()):
+            duration = (entry["finished"] or telemetry["finished"]) - entry["started"] if entry["started"] else None
+            transfer_time = ((entry["finished"] or telemetry["finished"]) - entry["first_byte"]
+                             if entry["first_byte"] else None)
+            machines.append({
+                "machine": machine_num,
+                "file": entry["file"],
+                "status": entry["status"],
+                "error": entry["error"],
+                "size_bytes": entry["total"],
+                "sent_bytes": entry["sent"],
+                "ttfb_ms": round((entry["first_byte"] - entry["started"]) * 1000, 1) if entry["first_byte"] else None,
+                "duration_s": round(duration, 3) if duration is not None else None,
+                # Seconds from the start of the run, so time spent queued for a slot counts too
+                "finished_after_s": round((entry["finished"] or telemetry["finished"]) - telemetry["started"], 3),
+                "avg_mb_s": round(entry["sent"] / transfer_time / (1024 * 1024), 3) if transfer_time else None,
+                "peak_mb_s": round(entry["peak_rate"] / (1024 * 1024), 3),
+                "preflight": entry["preflight"],
+                "attempts": entry["attempts"],
+                "preflight_write_ms": round(entry["preflight_write_ms"], 1) if entry["preflight_write_ms"] is not None else None,
+            })
+        run_duration = telemetry["finished"] - telemetry["started"]
+        total_sent = sum(machine["sent_bytes"] for machine in machines)
+        record = {
+            "run_id": telemetry["run_id"],
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(telemetry["started"])),
+            "duration_s": round(run_duration, 3),
+            "sent_bytes": total_sent,
+            "aggregate_mb_s": round(total_sent / run_duration / (1024 * 1024), 3) if run_duration > 0 else None,
+            "machines": machines,
+        }
+
+    try:
+        with open(TELEMETRY_EXPORT_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logging.error(f"Error exporting transfer telemetry: {e}")
+
+    timed = [machine for machine in machines if machine["duration_s"] is not None]
+    if timed:
+        slowest = max(timed, key=lambda machine: machine["duration_s"])
+        logging.info(f"Run {record['run_id']}: {record['aggregate_mb_s']} MB/s aggregate over "
+                     f"{record['duration_s']} s; slowest was Machine {slowest['machine']} "
+                     f"({slowest['duration_s']} s, {slowest['avg_mb_s']} MB/s).")
+    return record
+
+# Function to get a destination ready for writing
+def open_destination(src_path, dest_dir, machine_num, progress_slots, chunk_size=None):
+    """
+    Opens the destination file for a transfer and returns the transfer state, or None if the
+    destination already holds an identical copy. If a checkpoint from an interrupted attempt
+    is still valid, the file is opened at the last verified chunk instead of byte zero.
+    Without an explicit chunk_size, a resumed copy keeps its checkpoint's chunk size and a new
+    one uses the destination host's tuned size. Data goes to a temporary file next to the
+    destination, which finish_destination renames into place once it's verified.
+    """
+    dest_path = dest_dir / Path(src_path).name
+    temp_path = get_temp_path(dest_path)
+    file_name = os.path.basename(src_path)
+    checkpoint_path = get_checkpoint_path(machine_num, src_path)
+    total_size = os.path.getsize(src_path)
+    record_telemetry(machine_num, started=time.time(), total=total_size, status="preparing")
+
+    if SKIP_IDENTICAL_FILES and is_destination_identical(src_path, dest_path, machine_num):
+        logging.info(f"Machine {machine_num} already has an identical {file_name}. Skipping transfer.")
+        clear_checkpoint(checkpoint_path)
+        report_progress(progress_slots, machine_num, 1.0)
+        record_telemetry(machine_num, copied=total_size, finished=time.time(), status="skipped")
+        return None
+
+    checkpoint = load_checkpoint(checkpoint_path, src_path, temp_path, chunk_size) if RESUMABLE_TRANSFERS else None
+    offset = verify_checkpoint(checkpoint, temp_path) if checkpoint else 0
+    if offset:
+        logging.info(f"Resuming transfer of {file_name} to Machine {machine_num} at byte {offset}.")
+        chunk_size = checkpoint["chunk_size"]
+        del checkpoint["chunks"][(offset + chunk_size - 1) // chunk_size - checkpoint["first_chunk"]:]
+        checkpoint["confirmed"] = offset
+    else:
+        if chunk_size is None:
+            chunk_size = get_chunk_size(dest_dir)
+        checkpoint = new_checkpoint(src_path, temp_path, chunk_size)
+
+    dest = open_destination_file(temp_path, "r+b" if offset else "wb")
+    dest.seek(offset)
+    dest.truncate()
+    if total_size:
+        report_progress(progress_slots, machine_num, offset / total_size)
+    record_telemetry(machine_num, copied=offset, status="transferring")
+
+    return {
+        "machine_num": machine_num,
+        "src_path": src_path,
+        "dest_path": dest_path,
+        "temp_path": temp_path,
+        "file": dest,
+        "checkpoint_path": checkpoint_path,
+        "checkpoint": checkpoint,
+        "chunk_size": chunk_size,
+        "offset": offset,        # Byte the transfer (re)started from
+        "copied": offset,        # Bytes written so far
+        "total": total_size,
+        "recent_chunks": [],     # Last chunks written, hashed when the checkpoint is saved
+        "unsaved_bytes": 0,      # Bytes written since the checkpoint was last saved
+        "saved_at": time.monotonic(),
+    }
+
+# Function to write one chunk to a destination and report progress
+def write_destination_chunk(transfer, chunk, progress_slots):
+    transfer["file"].write(chunk)
+    transfer["copied"] += len(chunk)
+    record_transferred_bytes(len(chunk))
+    record_telemetry(transfer["machine_num"], copied=transfer["copied"], sent=len(chunk))
+
+    if RESUMABLE_TRANSFERS:
+        recent_chunks = transfer["recent_chunks"]
+        recent_chunks.append(chunk)
+        del recent_chunks[:-CHECKPOINT_VERIFY_CHUNKS]
+        transfer["unsaved_bytes"] += len(chunk)
+        # Saving every chunk would rewrite the checkpoint thousands of times for a large file
+        if (transfer["unsaved_bytes"] >= CHECKPOINT_SAVE_BYTES
+                or time.monotonic() - transfer["saved_at"] >= CHECKPOINT_SAVE_SECONDS):
+            save_transfer_checkpoint(transfer)
+
+    # Calculate progress as a fraction
+    progress = min(1.0, transfer["copied"] / transfer["total"])
+    report_progress(progress_slots, transfer["machine_num"], progress)  # Send progress update
+
+# Function to confirm everything written so far in a transfer's checkpoint
+def save_transfer_checkpoint(transfer):
+    # Only count chunks as confirmed once they have left our buffers
+    transfer["file"].flush()
+    checkpoint = transfer["checkpoint"]
+    chunk_size = transfer["chunk_size"]
+    checkpoint["chunks"] = [hashlib.sha256(chunk).hexdigest() for chunk in transfer["recent_chunks"]]
+    checkpoint["first_chunk"] = (transfer["copied"] + chunk_size - 1) // chunk_size - len(checkpoint["chunks"])
+    checkpoint["confirmed"] = transfer["copied"]
+    save_checkpoint(transfer["checkpoint_path"], checkpoint)
+    transfer["unsaved_bytes"] = 0
+    transfer["saved_at"] = time.monotonic()
+
+def finish_destination(transfer):
+    """
+    Closes a destination after its last chunk has been written, checks the temporary file
+    against the source and only then renames it to its final name, so the machine never sees
+    a partial file. A temporary file that fails the check is deleted with its checkpoint and
+    the transfer fails, to be retried from the start.
+    """
+    transfer["file"].close()
+    temp_path = transfer["temp_path"]
+    problem = None
+    temp_size = os.path.getsize(temp_path)
+    if temp_size != transfer["total"]:
+        problem = f"{temp_path.name} is {temp_size} bytes, expected {transfer['total']}"
+    elif VERIFY_BEFORE_RENAME == "checksum" and compute_file_digest(temp_path) != get_source_digest(transfer["src_path"]):
+        problem = f"{temp_path.name} doesn't match the source checksum"
+    if problem:
+        clear_checkpoint(transfer["checkpoint_path"])
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise IOError(f"Verification failed: {problem}")
+
+    os.replace(temp_path, transfer["dest_path"])
+    clear_checkpoint(transfer["checkpoint_path"])
+    record_telemetry(transfer["machine_num"], finished=time.time(), status="completed")
+    if SKIP_IDENTICAL_FILES:
+        record_destination_fingerprint(transfer["machine_num"], transfer["dest_path"],
+                                       get_source_digest(transfer["src_path"]))
+
+# Function to record a failed transfer; the checkpoint is kept so the next attempt can resume
+def report_transfer_failure(src_path, dest_dir, machine_num, progress_slots, error):
+    file_name = os.path.basename(src_path)  # Get the base file name
+    logging.error(f"Error copying file to {dest_dir} for Machine {machine_num}: {error}")
+    # Confirm that we’re sending -1 to indicate failure
+    logging.debug(f"Queueing failure for Machine {machine_num}")
+    report_progress(progress_slots, machine_num, -1)  # Send -1 to indicate a failure
+    record_telemetry(machine_num, finished=time.time(), status="failed", error=str(error))
+    record_failed_transfer(machine_num, src_path)
+    # Add to global fileErrors with machine_num as key and the failed file names as value
+    if machine_num not in fileErrors:
+        fileErrors[machine_num] = file_name
+    elif file_name not in fileErrors[machine_num].split(", "):
+        fileErrors[machine_num] += f", {file_name}"
+
+def copy_file(src_path, dest_dir, machine_num, progress_slots):
+    """
+    Copies the selected file to the specified destination directory and sends progress updates.
+    If a file transfer fails, sends a progress of -1 to indicate failure.
+    """
+    transfer = None
+    try:
+        transfer = open_destination(src_path, dest_dir, machine_num, progress_slots)
+        if transfer is None:
+            return
+
+        with open(src_path, "rb") as src:
+            src.seek(transfer["offset"])
+            while chunk := src.read(transfer["chunk_size"]):  # Read in chunks
+                write_destination_chunk(transfer, chunk, progress_slots)
+
+        finish_destination(transfer)
+
+    except Exception as e:
+        if transfer:
+            transfer["file"].close()
+        report_transfer_failure(src_path, dest_dir, machine_num, progress_slots, e)
+
+def fan_out_copy(src_path, destinations, progress_slots, cleanup_first=False):
+    """
+    Copies one source file to several destinations, reading it from disk only once.
+    Each destination's writer thread cleans and opens its own destination, so cleanups and
+    identical-copy and checkpoint checks run at the same time, then writes the chunks the
+    reader shares among them. Bounded per-writer queues keep the reader from running more than
+    FAN_OUT_BUFFER_CHUNKS ahead of the slowest destination. The reader starts at the beginning
+    of the file and a writer skips the chunks its destination already has from a resumed
+    checkpoint. `destinations` is a list of (dest_dir, machine_num) tuples. With cleanup_first,
+    each destination's old .bin files are deleted just before it is opened, and its upload
+    doesn't wait for the other destinations' cleanups.
+    """
+    source_errors = []  # Set by the reader if the source can't be read to the end
+
+    def write_chunks(writer, dest_dir, machine_num):
+        chunk_queue = writer["queue"]
+        try:
+            if cleanup_first:
+                delete_bin_files_on_machine(machine_num, dest_dir, keep=Path(src_path).name)
+            # Every writer receives the reader's chunks, so they all share one chunk size
+            transfer = open_destination(src_path, dest_dir, machine_num, progress_slots, TRANSFER_CHUNK_SIZE)
+        except Exception as e:
+            transfer = None
+            report_transfer_failure(src_path, dest_dir, machine_num, progress_slots, e)
+        failed = transfer is None  # Already identical, or couldn't be opened
+        writer["done"] = failed
+        while (item := chunk_queue.get()) is not None:
+            offset, chunk = item
+            # Skip failed writers and chunks this destination already has from a resumed checkpoint
+            if failed or offset < transfer["copied"]:
+                continue
+            try:
+                write_destination_chunk(transfer, chunk, progress_slots)
+            except Exception as e:
+                failed = writer["done"] = True  # Keep draining so the reader never blocks on this queue
+                transfer["file"].close()
+                report_transfer_failure(src_path, dest_dir, machine_num, progress_slots, e)
+        if failed:
+            return
+        try:
+            if source_errors:
+                raise source_errors[0]
+            finish_destination(transfer)
+        except Exception as e:
+            transfer["file"].close()
+            report_transfer_failure(src_path, dest_dir, machine_num, progress_slots, e)
+
+    writers = []
+    for dest_dir, machine_num in destinations:
+        writer = {"queue": queue.Queue(maxsize=FAN_OUT_BUFFER_CHUNKS), "done": False}
+        writer["thread"] = threading.Thread(target=write_chunks, args=(writer, dest_dir, machine_num), daemon=True)
+        writers.append(writer)
+        writer["thread"].start()
+    logging.info(f"Fanning out {os.path.basename(src_path)} to {len(writers)} machine(s) from one read.")
+
+    try:
+        with open(src_path, "rb") as src:
+            offset = 0
+            # Stop early once every destination turned out to be identical or failed
+            while not all(writer["done"] for writer in writers) and (chunk := src.read(TRANSFER_CHUNK_SIZE)):
+                for writer in writers:
+                    writer["queue"].put((offset, chunk))
+                offset += len(chunk)
+    except Exception as e:
+        # The source itself failed, so every destination that was still writing fails with it
+        source_errors.append(e)
+    finally:
+        for writer in writers:
+            writer["queue"].put(None)
+        for writer in writers:
+            writer["thread"].join()
+
+# State shared by the transfer scheduler; guarded by transfer_slots
+transfer_slots = threading.Condition()
+transfer_slot_state = {
+    "limit": INITIAL_CONCURRENT_TRANSFERS,  # Current adaptive global limit
+    "active": 0,                            # Destinations currently being written
+    "hosts": {},                            # host -> active transfers
+    "subnets": {},                          # subnet -> active transfers
+    "bytes": 0,                             # Bytes written since the stage started
+}
+
+# Function to get the host name or IP from a destination share path
+def get_destination_host(dest_dir):
+    if not str(dest_dir).startswith("\\\\"):
+        return str(dest_dir)  # A local or mapped directory stands in for a host of its own
+    parts = [part for part in str(dest_dir).replace("/", "\\").split("\\") if part]
+    return parts[0] if parts else str(dest_dir)
+
+# Function to get the /24 a host belongs to, or the host itself if it isn't an IPv4 address
+def get_host_subnet(host):
+    octets = host.split(".")
+    if len(octets) == 4 and all(octet.isdigit() for octet in octets):
+        return ".".join(octets[:3])
+    return host
+
+# Function to check whether a transfer to these hosts fits within every limit
+def can_start_transfer(hosts):
+    state = transfer_slot_state
+    if state["active"] == 0 and len(hosts) == 1:
+        return True  # Never leave the floor idle, whatever the limits are set to
+    if state["active"] + len(hosts) > state["limit"]:
+        return False
+    subnet_counts = {}
+    for host in hosts:
+        if state["hosts"].get(host, 0) + 1 > MAX_TRANSFERS_PER_HOST:
+            return False
+        subnet = get_host_subnet(host)
+        subnet_counts[subnet] = subnet_counts.get(subnet, 0) + 1
+    return all(state["subnets"].get(subnet, 0) + count <= MAX_TRANSFERS_PER_SUBNET
+               for subnet, count in subnet_counts.items())
+
+# Function to wait until a transfer to these hosts may start, then reserve its slots
+def acquire_transfer_slots(hosts):
+    with transfer_slots:
+        transfer_slots.wait_for(lambda: can_start_transfer(hosts))
+        state = transfer_slot_state
+        state["active"] += len(hosts)
+        for host in hosts:
+            state["hosts"][host] = state["hosts"].get(host, 0) + 1
+            subnet = get_host_subnet(host)
+            state["subnets"][subnet] = state["subnets"].get(subnet, 0) + 1
+
+# Function to give back the slots reserved by acquire_transfer_slots
+def release_transfer_slots(hosts):
+    with transfer_slots:
+        state = transfer_slot_state
+        state["active"] -= len(hosts)
+        for host in hosts:
+            state["hosts"][host] -= 1
+            state["subnets"][get_host_subnet(host)] -= 1
+        transfer_slots.notify_all()
+
+# Function to count bytes written towards the aggregate throughput
+def record_transferred_bytes(byte_count):
+    with transfer_slots:
+        transfer_slot_state["bytes"] += byte_count
+
+# Function to split one file's fan-out into groups of destinations that share a read. Each group
+# fits the scheduler's tightest limits, so it can always be admitted and never writes to more
+# machines at once than the adaptive limit allows.
+def group_fan_out_destinations(destinations):
+    group_size = MIN_CONCURRENT_TRANSFERS
+    groups = []
+    for dest_dir, machine_num in destinations:
+        host = get_destination_host(dest_dir)
+        for group in groups:
+            hosts = [get_destination_host(group_dir) for group_dir, _ in group]
+            if (len(group) < group_size and hosts.count(host) < MAX_TRANSFERS_PER_HOST
+                    and sum(get_host_subnet(other) == get_host_subnet(host) for other in hosts) < MAX_TRANSFERS_PER_SUBNET):
+                group.append((dest_dir, machine_num))
+                break
+        else:
+            groups.append([(dest_dir, machine_num)])
+    return groups
+
+# Function to run a transfer job once the scheduler has room for all of its destinations
+def run_scheduled_transfer(hosts, transfer_func, *args):
+    acquire_transfer_slots(hosts)
+    try:
+        transfer_func(*args)
+    finally:
+        release_transfer_slots(hosts)
+
+def adapt_transfer_concurrency(stop_event):
+    """
+    Hill-climbs the global transfer limit on measured aggregate throughput: one more slot
+    while MB/s keeps improving, one fewer when it drops, unchanged while it holds steady.
+    """
+    previous_rate = None
+    with transfer_slots:
+        previous_bytes = transfer_slot_state["bytes"]
+
+    while not stop_event.wait(CONCURRENCY_SAMPLE_INTERVAL):
+        with transfer_slots:
+            state = transfer_slot_state
+            rate = (state["bytes"] - previous_bytes) / CONCURRENCY_SAMPLE_INTERVAL
+            previous_bytes = state["bytes"]
+            saturated = state["active"] >= state["limit"]
+            old_limit = state["limit"]
+
+            if previous_rate is not None:
+                if rate > previous_rate * (1 + CONCURRENCY_TOLERANCE) and saturated:
+                    state["limit"] = min(MAX_CONCURRENT_TRANSFERS, state["limit"] + 1)
+                elif rate < previous_rate * (1 - CONCURRENCY_TOLERANCE):
+                    state["limit"] = max(MIN_CONCURRENT_TRANSFERS, state["limit"] - 1)
+            elif saturated:
+                state["limit"] = min(MAX_CONCURRENT_TRANSFERS, state["limit"] + 1)
+
+            if state["limit"] != old_limit:
+                logging.debug(f"Transfer concurrency {old_limit} -> {state['limit']} "
+                              f"at {rate / (1024 * 1024):.2f} MB/s.")
+                transfer_slots.notify_all()
+        previous_rate = rate
+
+# Function to delete the .bin files on one machine's share; safe to run from a worker thread
+def delete_bin_files_on_machine(machine_num, directory, keep=None):
+    """
+    Deletes every .bin file in `directory` except `keep` (the name, or set of names, about to be
+    uploaded, so an identical or partially transferred copy can still be reused). Returns a result dict with the
+    number of files deleted and any errors instead of showing them.
+    """
+    result = {"machine": machine_num, "deleted": 0, "errors": []}
+    try:
+        bin_files = list(directory.glob("*.bin"))
+    except Exception as e:
+        result["errors"].append(f"{directory}: {e}")
+        return result
+
+    keep_names = {keep} if isinstance(keep, str) else set(keep or ())
+    for file_path in bin_files:
+        if file_path.name in keep_names:
+            continue
+        try:
+            os.remove(file_path)
+            forget_destination_fingerprint(machine_num, file_path)
+            result["deleted"] += 1
+        except Exception as e:
+            result["errors"].append(f"{file_path}: {e}")
+    try:
+        remove_stale_temp_files(machine_num, directory, keep_names)
+    except Exception as e:
+        result["errors"].append(f"{directory}: {e}")
+    logging.info(f"Deleted {result['deleted']} .bin file(s) from Machine {machine_num}.")
+    for error in result["errors"]:
+        logging.error(f"Error deleting .bin files for Machine {machine_num}: {error}")
+    return result
+
+# Function to copy a file to one machine right after cleaning that machine's share
+def clean_and_copy_file(src_path, dest_dir, machine_num, progress_slots):
+    delete_bin_files_on_machine(machine_num, dest_dir, keep=Path(src_path).name)
+    copy_file(src_path, dest_dir, machine_num, progress_slots)
+
+# ---- Bulk assignment planner: more files than machines are staged in waves ----
+# Each machine gets a bin of files balanced by size and its measured throughput. A machine's
+# bin is copied one file after another, so its next wave starts as soon as it finishes one.
+
+PLANNER_HISTORY_RUNS = 5      # Recent telemetry runs averaged into a machine's throughput
+PLANNER_DEFAULT_MB_S = 1.0    # Throughput assumed when nothing has been measured yet
+
+def get_machine_throughputs(machines):
+    """
+    Estimates each machine's throughput in MB/s from its average over the last
+    PLANNER_HISTORY_RUNS exported telemetry runs, then from the best rate its host reached
+    while probing chunk sizes, and otherwise the median of the machines that are known.
+    """
+    samples = {machine_num: [] for machine_num in machines}
+    try:
+        with open(TELEMETRY_EXPORT_FILE, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        lines = []
+    except OSError as e:
+        logging.warning(f"Couldn't read transfer history from {TELEMETRY_EXPORT_FILE}: {e}")
+        lines = []
+
+    # Newest runs are at the end of the file
+    for line in reversed(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        for machine in record.get("machines", []):
+            rates = samples.get(machine.get("machine"))
+            if rates is not None and machine.get("avg_mb_s") and len(rates) < PLANNER_HISTORY_RUNS:
+                rates.append(machine["avg_mb_s"])
+
+    throughputs = {}
+    profiles = get_chunk_profiles()
+    for machine_num, rates in samples.items():
+        if rates:
+            throughputs[machine_num] = sum(rates) / len(rates)
+            continue
+        dest_dir = get_destination_directory(machine_num)
+        profile = profiles.get(get_destination_host(dest_dir)) if dest_dir else None
+        probed = [rate for rate in (profile or {}).get("throughput_mb_s", {}).values() if rate > 0]
+        if probed:
+            throughputs[machine_num] = max(probed)
+
+    known = sorted(throughputs.values())
+    default = known[len(known) // 2] if known else PLANNER_DEFAULT_MB_S
+    return {machine_num: throughputs.get(machine_num, default) for machine_num in machines}
+
+def plan_file_waves(files, machines, throughputs, holders=None):
+    """
+    Splits `files` into one bin per machine so every machine finishes at about the same time.
+    A file that `holders` (file path -> machines already holding an identical copy) lists is
+    kept on one of those machines, since it won't be sent again; that keeps the plan the same
+    from run to run instead of moving files with every change in measured throughput. The
+    other files are placed largest first, each on the machine whose bin would then finish
+    earliest given its throughput. Within a bin files keep their selection order, so a
+    machine's waves run in the order the operator picked them. Returns machine_num -> list
+    of file paths.
+    """
+    holders = holders or {}
+    sizes = {}
+    for file_path in files:
+        try:
+            sizes[file_path] = os.path.getsize(file_path)
+        except OSError:
+            sizes[file_path] = 0  # The transfer reports the missing file
+
+    bins = {machine_num: [] for machine_num in machines}
+    finish_times = {machine_num: 0.0 for machine_num in machines}
+    new_files = []
+    for file_path in files:
+        held_by = sorted(machine_num for machine_num in holders.get(file_path, ()) if machine_num in bins)
+        if not held_by:
+            new_files.append(file_path)
+            continue
+        # Costs no transfer time, so it only breaks ties between holders by bin length
+        bins[min(held_by, key=lambda machine_num: (len(bins[machine_num]), machine_num))].append(file_path)
+
+    for file_path in sorted(new_files, key=lambda file_path: sizes[file_path], reverse=True):
+        seconds = {machine_num: sizes[file_path] / (throughputs[machine_num] * 1024 * 1024)
+                   for machine_num in machines}
+        machine_num = min(machines, key=lambda machine_num: (finish_times[machine_num] + seconds[machine_num], machine_num))
+        bins[machine_num].append(file_path)
+        finish_times[machine_num] += seconds[machine_num]
+
+    order = {file_path: index for index, file_path in enumerate(files)}
+    for machine_files in bins.values():
+        machine_files.sort(key=order.get)
+    return bins
+
+# Function to find which machines already hold an identical copy of each file, from the local
+# fingerprint cache only, so planning never waits on a share
+def get_file_holders(files, machines):
+    cache = get_digest_cache()
+    holders = {}
+    for file_path in files:
+        try:
+            digest = get_source_digest(file_path)
+        except OSError:
+            continue  # The transfer reports the missing file
+        for machine_num in machines:
+            dest_dir = get_destination_directory(machine_num)
+            if dest_dir is None:
+                continue
+            with digest_cache_lock:
+                fingerprint = cache["destinations"].get(f"{machine_num}|{dest_dir / Path(file_path).name}")
+            if fingerprint and fingerprint["digest"] == digest:
+                holders.setdefault(file_path, set()).add(machine_num)
+    return holders
+
+def assign_files(all_files, machines, same_file=False):
+    """
+    Pairs files with machines and returns a list of (machine_num, file_path) tuples, with None
+    for a machine that gets no file. Files are assigned in order while there are enough
+    machines; with more files than machines they're planned into waves and listed wave by
+    wave. With same_file, the first file goes to every machine.
+    """
+    selected_machines = sorted(machines)
+
+    # Stage one file on the whole selection if requested
+    if all_files and same_file:
+        return [(machine_num, all_files[0]) for machine_num in selected_machines]
+
+    # More files than machines: plan bins and list them wave by wave
+    if selected_machines and len(all_files) > len(selected_machines):
+        bins = plan_file_waves(all_files, selected_machines, get_machine_throughputs(selected_machines),
+                               get_file_holders(all_files, selected_machines))
+        waves = max(len(machine_files) for machine_files in bins.values())
+        logging.info(f"Planned {len(all_files)} files across {len(selected_machines)} machines in {waves} waves.")
+        assignments = [(machine_num, bins[machine_num][wave])
+                       for wave in range(waves) for machine_num in selected_machines if wave < len(bins[machine_num])]
+        assignments += [(machine_num, None) for machine_num in selected_machines if not bins[machine_num]]
+        return assignments
+
+    # Create direct machine-to-file assignments
+    return [(machine_num, all_files[index] if index < len(all_files) else None)
+            for index, machine_num in enumerate(selected_machines)]
+
+def start_copying_files(file_assignments, progress_slots, copy_complete_event, progress_bars=None, cleanup_first=False):
+    """
+    Start file copy operations concurrently, using the filtered file_assignments list.
+    Limits the operation to the number of files available. How many copies write at once is
+    bounded per host and per subnet, and globally by a limit that adapts to measured throughput.
+    With cleanup_first, each machine's old .bin files are deleted just before its own upload.
+    Destinations that fail a pre-flight check are marked failed without being attempted.
+    A machine assigned several files copies them in turn, each as soon as the last one ends.
+    (Machine, file) pairs that fail are re-queued on their own with exponential backoff, up to
+    TRANSFER_MAX_ATTEMPTS attempts; whatever still fails is kept for "Retry Failed Only".
+    """
+    # Every job gets a thread, but the scheduler decides how many of them write at once
+    with transfer_slots:
+        transfer_slot_state["limit"] = INITIAL_CONCURRENT_TRANSFERS
+    stop_adapting = threading.Event()
+    threading.Thread(target=adapt_transfer_concurrency, args=(stop_adapting,), daemon=True).start()
+
+    try:
+        pending = file_assignments
+        for attempt in range(1, TRANSFER_MAX_ATTEMPTS + 1):
+            # Machines were already cleaned on the first attempt, along with files that have since arrived
+            failed = run_transfer_pass(pending, progress_slots, cleanup_first and attempt == 1)
+            if not failed or attempt == TRANSFER_MAX_ATTEMPTS:
+                break
+            delay = min(TRANSFER_RETRY_MAX_DELAY, TRANSFER_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            delay = random.uniform(delay / 2, delay)  # Jitter so recovering cards aren't all hit at once
+            logging.info(f"Retrying {len(failed)} failed transfer(s) in {delay:.1f} s "
+                         f"(attempt {attempt + 1} of {TRANSFER_MAX_ATTEMPTS}).")
+            time.sleep(delay)
+            prepare_transfer_retry(failed, progress_slots, attempt + 1)
+            pending = failed
+        retryable_transfers[:] = failed  # Updated in place so the UI's reference stays current
+    finally:
+        stop_adapting.set()
+        copy_complete_event.set()  # Signal that all copies are complete
+
+def run_transfer_pass(file_assignments, progress_slots, cleanup_first=False):
+    """
+    Runs one pass over `file_assignments` and returns the (machine_num, file_path) pairs that
+    failed and are worth retrying.
+    """
+    with failed_transfers_lock:
+        failed_transfers.clear()
+
+    files_by_machine = {}
+    for machine_num, file_path in file_assignments:
+        files_by_machine.setdefault(machine_num, [])
+        if file_path is not None:
+            files_by_machine[machine_num].append(file_path)
+
+    # Leave out destinations that are down or full so they can't hold up the rest of the batch
+    machine_waves.clear()
+    # Swap in compressed copies first, so pre-flight keeps their partial .gz.part files for resuming
+    # and checks space for the bytes that will actually be sent
+    if COMPRESS_TRANSFERS:
+        files_by_machine = use_compressed_sources(files_by_machine)
+    if PREFLIGHT_CHECKS:
+        files_by_machine = run_preflight_checks(files_by_machine, progress_slots, cleanup_first)
+
+    # Group single-file destinations by source so a file going to several machines is read only once;
+    # machines planned with several files work through them in waves
+    destinations_by_file = {}
+    wave_jobs = []
+    for machine_num, files in files_by_machine.items():
+        dest_dir = get_destination_directory(machine_num)
+        if not files or dest_dir is None:
+            logging.warning(f"No destination path or file for Machine {machine_num}. Skipping.")
+            report_progress(progress_slots, machine_num, -1)  # Mark progress as complete for skipped files
+        elif len(files) == 1:
+            destinations_by_file.setdefault(files[0], []).append((dest_dir, machine_num))
+        else:
+            machine_waves[machine_num] = new_machine_waves(files)
+            wave_jobs.append((machine_num, dest_dir, files, progress_slots, cleanup_first))
+
+    jobs = []
+    for file_path, destinations in destinations_by_file.items():
+        if FAN_OUT_TRANSFERS and len(destinations) > 1:
+            for group in group_fan_out_destinations(destinations):
+                hosts = [get_destination_host(dest_dir) for dest_dir, _ in group]
+                jobs.append((hosts, fan_out_copy, file_path, group, progress_slots, cleanup_first))
+        else:
+            copy_func = clean_and_copy_file if cleanup_first else copy_file
+            for dest_dir, machine_num in destinations:
+                jobs.append(([get_destination_host(dest_dir)], copy_func, file_path, dest_dir, machine_num, progress_slots))
+
+    with ThreadPoolExecutor(max_workers=max(1, len(jobs) + len(wave_jobs))) as executor:
+        futures = [executor.submit(run_scheduled_transfer, *job) for job in jobs]
+        futures += [executor.submit(run_machine_waves, *job) for job in wave_jobs]
+
+        for future in futures:
+            future.result()  # Wait for all threads to complete
+
+    with failed_transfers_lock:
+        return list(failed_transfers)
+
+# Function to reset the progress and telemetry of machines about to be retried
+def prepare_transfer_retry(failed, progress_slots, attempt):
+    machine_waves.clear()  # A retry only covers the failed files, so earlier waves no longer apply
+    for machine_num in {machine_num for machine_num, _ in failed}:
+        progress_slots.pop(machine_num, None)  # Lift the failure mark so the new attempt is shown
+        fileErrors.pop(machine_num, None)
+        record_telemetry(machine_num, status="queued", finished=None, error=None, attempts=attempt)
+        with telemetry_lock:
+            entry = transfer_telemetry["machines"].get(machine_num) if transfer_telemetry else None
+            if entry is not None:
+                # Start a new sample window, as the failed attempt already took its final sample
+                entry.update(rate=0.0, sample_time=time.time(), sample_sent=entry["sent"], final_sampled=False)
+
+# ---- Headless staging: whole stages and cleanups without the UI ----
+
+def stage_files(file_assignments, cleanup_first=False, on_progress=None, progress_interval=1.0):
+    """
+    Runs a complete stage of (machine_num, file_path) pairs and returns the telemetry record
+    exported for it. Blocks until every transfer, including automatic retries, has finished.
+    `on_progress(telemetry)` is called every progress_interval seconds while copies run.
+    """
+    assignments = [(machine_num, file_path) for machine_num, file_path in file_assignments if file_path]
+    telemetry = start_transfer_telemetry(assignments)
+    copy_complete_event = threading.Event()
+    progress_slots = {}
+    worker = threading.Thread(
+        target=start_copying_files,
+        args=(assignments, progress_slots, copy_complete_event),
+        kwargs={"cleanup_first": cleanup_first}
+    )
+    worker.start()
+    while not copy_complete_event.wait(progress_interval):
+        sample_transfer_telemetry(telemetry, time.time())
+        if on_progress:
+            on_progress(telemetry)
+    worker.join()
+    sample_transfer_telemetry(telemetry, time.time())
+    return export_transfer_telemetry(telemetry)
+
+# Function to delete the .bin files on several machines at once; returns one result dict per machine
+def clean_machines(machine_nums, keep=None):
+    targets = [(machine_num, get_destination_directory(machine_num))
+               for machine_num in machine_nums if get_destination_directory(machine_num) is not None]
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as executor:
+        return list(executor.map(lambda target: delete_bin_files_on_machine(*target, keep=keep), targets))
+
+# Function to parse a machine list such as "1-9" or "1,3,5-7"
+def parse_machine_list(text):
+    machines = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        try:
+            first, last = int(first), int(last or first)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid machine range {part!r}")
+        if first > last:
+            raise argparse.ArgumentTypeError(f"invalid machine range {part!r}: {first} comes after {last}")
+        machines.extend(range(first, last + 1))
+    if not machines:
+        raise argparse.ArgumentTypeError(f"no machines in {text!r}")
+    return sorted(set(machines))
+
+def main(argv=None):
+    """
+    Command-line entry point. `stage` copies files to machines the same way the Transfer
+    button does and exits with 1 if any machine failed; `clean` deletes their .bin files.
+    Machines aren't claimed in Firebase, so don't point it at machines a station is staging.
+    """
+    global PREFLIGHT_CHECKS
+    parser = argparse.ArgumentParser(prog="staging_engine", description="Stage job files onto machines without the UI.")
+    parser.add_argument("--registry", type=Path, default=MACHINE_REGISTRY_FILE, help="machine registry JSON file")
+    parser.add_argument("--verbose", action="store_true", help="log engine details to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stage = commands.add_parser("stage", help="copy files to machines")
+    stage.add_argument("--machines", type=parse_machine_list, required=True, help="machines to stage, e.g. 1-9 or 1,3,5-7")
+    stage.add_argument("--files", nargs="+", required=True, help="job files, assigned in order or planned into waves")
+    stage.add_argument("--same-file", action="store_true", help="send the first file to every machine")
+    stage.add_argument("--cleanup", action="store_true", help="delete each machine's .bin files just before its upload")
+    stage.add_argument("--no-preflight", action="store_true", help="skip the destination pre-flight checks")
+
+    clean = commands.add_parser("clean", help="delete .bin files from machines")
+    clean.add_argument("--machines", type=parse_machine_list, required=True, help="machines to clean, e.g. 1-9")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    set_machine_registry(load_machine_registry(args.registry))
+    unknown = [machine_num for machine_num in args.machines if get_destination_directory(machine_num) is None]
+    if unknown:
+        parser.error(f"no destination for machine(s) {', '.join(map(str, unknown))} in {args.registry}")
+    disabled = [machine_num for machine_num in args.machines if not is_machine_enabled(machine_num)]
+    if disabled:
+        parser.error(f"machine(s) {', '.join(map(str, disabled))} are disabled in {args.registry}")
+
+    if args.command == "clean":
+        results = clean_machines(args.machines)
+        for result in results:
+            print(f"Machine {result['machine']}: deleted {result['deleted']} .bin file(s)"
+                  + (f", {len(result['errors'])} error(s): {result['errors'][0]}" if result["errors"] else ""))
+        return 1 if any(result["errors"] for result in results) else 0
+
+    missing = [file_path for file_path in args.files if not os.path.isfile(file_path)]
+    if missing:
+        parser.error(f"file(s) not found: {', '.join(missing)}")
+    if args.no_preflight:
+        PREFLIGHT_CHECKS = False
+
+    assignments = assign_files(args.files, args.machines, same_file=args.same_file)
+    record = stage_files(assignments, cleanup_first=args.cleanup,
+                         on_progress=lambda telemetry: print(describe_run_telemetry(telemetry), flush=True))
+    for machine in record["machines"]:
+        print(f"Machine {machine['machine']}: {machine['status']} {machine['file']}"
+              + (f" ({machine['avg_mb_s']} MB/s)" if machine["avg_mb_s"] else "")
+              + (f" - {machine['error']}" if machine["error"] else ""))
+    print(f"{record['sent_bytes'] / (1024 * 1024):.1f} MB in {record['duration_s']} s "
+          f"({record['aggregate_mb_s']} MB/s aggregate).")
+    return 1 if any(machine["status"] == "failed" for machine in record["machines"]) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
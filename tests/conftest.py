@@ -0,0 +1,65 @@
+# Shared fixtures: every test runs the engine in its own working directory against local
+# stand-in machine directories, with the engine's caches and run state reset.
+
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import staging_engine as engine
+
+
+@pytest.fixture(autouse=True)
+def isolated_engine(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Checkpoints, caches and telemetry are relative to the working directory
+    monkeypatch.setattr(engine, "digest_cache", None)
+    monkeypatch.setattr(engine, "chunk_profiles", None)
+    monkeypatch.setattr(engine, "transfer_telemetry", None)
+    monkeypatch.setattr(engine, "open_destination_file", open)
+    monkeypatch.setattr(engine, "AUTO_TUNE_CHUNK_SIZE", False)
+    monkeypatch.setattr(engine, "TRANSFER_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(engine, "PREFLIGHT_CHECKS", engine.PREFLIGHT_CHECKS)
+    engine.chunk_probe_locks.clear()
+    engine.machine_waves.clear()
+    engine.fileErrors.clear()
+    engine.retryable_transfers.clear()
+    engine.failed_transfers.clear()
+    registry = dict(engine.machine_registry)
+    yield
+    engine.set_machine_registry(registry)
+
+
+@pytest.fixture
+def machines(tmp_path):
+    """
+    Returns a function that writes a registry of `count` stand-in machines, each a directory
+    under tmp_path, loads it into the engine and returns the registry file's path. Keyword
+    arguments named m<N> update machine N's entry, e.g. m1={"enabled": False}.
+    """
+    def make_machines(count, **overrides):
+        entries = []
+        for machine_num in range(1, count + 1):
+            dest_dir = tmp_path / f"machine-{machine_num}"
+            dest_dir.mkdir(exist_ok=True)
+            entry = {"number": machine_num, "path": str(dest_dir), "row": 0, "column": machine_num - 1}
+            entry.update(overrides.get(f"m{machine_num}", {}))
+            entries.append(entry)
+        registry_path = tmp_path / "machines.json"
+        registry_path.write_text(json.dumps({"machines": entries}), encoding="utf-8")
+        engine.set_machine_registry(engine.load_machine_registry(registry_path))
+        return registry_path
+    return make_machines
+
+
+@pytest.fixture
+def job_file(tmp_path):
+    """Returns a function that writes a job file of random bytes and returns its path as a string."""
+    def make_job_file(name, size):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(size))
+        return str(path)
+    return make_job_file
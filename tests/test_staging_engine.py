@@ -0,0 +1,367 @@
+import argparse
+import json
+import logging
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import staging_engine as engine
+
+
+# A destination file that raises on chosen writes, standing in for a card that drops off the network
+class FailingFile:
+    def __init__(self, file, should_fail):
+        self.file = file
+        self.should_fail = should_fail
+
+    def write(self, data):
+        if self.should_fail(data):
+            raise OSError("Injected write failure")
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+
+# Function to build an open() replacement whose files fail once `limit` bytes have gone to one
+# destination, `times` times in total
+def make_failing_opener(dest_dir, limit, times=1):
+    failures = {"left": times}
+
+    def open_failing(path, mode="r", *args, **kwargs):
+        file = open(path, mode, *args, **kwargs)
+        if os.path.dirname(path) != str(dest_dir) or "b" not in mode:
+            return file
+        written = {"bytes": 0}
+
+        def should_fail(data):
+            written["bytes"] += len(data)
+            if failures["left"] and written["bytes"] > limit:
+                failures["left"] -= 1
+                return True
+            return False
+        return FailingFile(file, should_fail)
+    return open_failing
+
+
+# ---- Registry and command line ----
+
+def test_duplicate_machine_error_names_the_registry_file(tmp_path):
+    registry_path = tmp_path / "floor.json"
+    registry_path.write_text(json.dumps({"machines": [
+        {"number": 1, "host": "10.0.0.1", "row": 0, "column": 0},
+        {"number": 1, "path": "elsewhere", "row": 0, "column": 1},
+    ]}), encoding="utf-8")
+    with pytest.raises(ValueError, match="floor.json"):
+        engine.load_machine_registry(registry_path)
+
+
+def test_parse_machine_list_accepts_ranges_and_lists():
+    assert engine.parse_machine_list("5, 1-3,2") == [1, 2, 3, 5]
+
+
+@pytest.mark.parametrize("text", ["3-1", "", " , ", "1-x"])
+def test_parse_machine_list_rejects_reversed_empty_and_invalid_ranges(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        engine.parse_machine_list(text)
+
+
+def test_stage_rejects_disabled_machines(machines, job_file, tmp_path):
+    registry_path = machines(2, m1={"enabled": False})
+    with pytest.raises(SystemExit) as exit_info:
+        engine.main(["--registry", str(registry_path), "stage", "--machines", "1-2", "--files", job_file("a.bin", 1024)])
+    assert exit_info.value.code == 2
+    assert not any((tmp_path / "machine-1").iterdir())
+
+
+def test_stage_rejects_reversed_machine_range(machines, job_file):
+    registry_path = machines(3)
+    with pytest.raises(SystemExit) as exit_info:
+        engine.main(["--registry", str(registry_path), "stage", "--machines", "3-1", "--files", job_file("a.bin", 1024)])
+    assert exit_info.value.code == 2
+
+
+def test_stage_copies_files_and_exits_zero(machines, job_file, tmp_path):
+    registry_path = machines(2)
+    files = [job_file("a.bin", 300 * 1024), job_file("b.bin", 1024)]
+    assert engine.main(["--registry", str(registry_path), "stage", "--machines", "1-2", "--files", *files]) == 0
+    assert (tmp_path / "machine-1" / "a.bin").read_bytes() == (tmp_path / "a.bin").read_bytes()
+    assert (tmp_path / "machine-2" / "b.bin").read_bytes() == (tmp_path / "b.bin").read_bytes()
+
+
+# ---- Planner ----
+
+def test_plan_places_largest_files_first_and_keeps_selection_order(job_file):
+    small = [job_file(f"small-{index}.bin", 1000) for index in range(3)]
+    large = job_file("large.bin", 3000)
+    bins = engine.plan_file_waves([small[0], large, small[1], small[2]], [1, 2], {1: 1.0, 2: 1.0})
+    assert bins == {1: [large], 2: small}
+
+
+def test_plan_keeps_held_files_on_their_holder(job_file):
+    files = [job_file(f"{name}.bin", 1000) for name in "abc"]
+    # Machine 2 is far faster, but machine 1 already has a.bin and won't need it sent again
+    bins = engine.plan_file_waves(files, [1, 2], {1: 1.0, 2: 100.0}, holders={files[0]: {1}})
+    assert files[0] in bins[1]
+    assert set(bins[2]) == set(files[1:])
+
+
+def test_assign_files_is_stable_when_measured_throughput_changes(machines, job_file, tmp_path):
+    machines(3)
+    files = [job_file(f"{name}.bin", size) for name, size in zip("abcd", (400, 300, 200, 100))]
+    first = engine.assign_files(files, [1, 2, 3])
+    engine.stage_files(first)
+
+    # Reverse which machines look fastest for the whole planner history window
+    with open(engine.TELEMETRY_EXPORT_FILE, "a", encoding="utf-8") as f:
+        for _ in range(engine.PLANNER_HISTORY_RUNS):
+            machines_record = [{"machine": machine_num, "avg_mb_s": rate} for machine_num, rate in ((1, 0.1), (2, 50.0), (3, 5.0))]
+            f.write(json.dumps({"machines": machines_record}) + "\n")
+
+    second = engine.assign_files(files, [1, 2, 3])
+    assert sorted(second) == sorted(first)
+    record = engine.stage_files(second)
+    assert {machine["status"] for machine in record["machines"]} == {"skipped"}
+    staged = sorted(path.name for machine_num in (1, 2, 3) for path in (tmp_path / f"machine-{machine_num}").glob("*.bin"))
+    assert staged == ["a.bin", "b.bin", "c.bin", "d.bin"]
+
+
+# ---- Scheduler ----
+
+def slot_state(active=0, limit=4, hosts=None):
+    hosts = hosts or {}
+    subnets = {}
+    for host, count in hosts.items():
+        subnet = engine.get_host_subnet(host)
+        subnets[subnet] = subnets.get(subnet, 0) + count
+    return {"limit": limit, "active": active, "hosts": hosts, "subnets": subnets, "bytes": 0}
+
+
+def test_scheduler_starts_a_single_transfer_when_idle(monkeypatch):
+    monkeypatch.setattr(engine, "MAX_TRANSFERS_PER_SUBNET", 0)
+    monkeypatch.setattr(engine, "transfer_slot_state", slot_state(limit=1))
+    assert engine.can_start_transfer(["10.0.0.1"])
+
+
+def test_scheduler_holds_a_fan_out_wider_than_the_limit_when_idle(monkeypatch):
+    monkeypatch.setattr(engine, "transfer_slot_state", slot_state(limit=2))
+    assert not engine.can_start_transfer(["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+
+
+def test_fan_out_groups_fit_the_tightest_limits(monkeypatch):
+    monkeypatch.setattr(engine, "MAX_TRANSFERS_PER_SUBNET", 1)
+    destinations = [(f"\\\\192.168.68.{host}\\DavWWWRoot", host) for host in range(1, 10)]
+    destinations += [("\\\\10.0.0.1\\DavWWWRoot", 10), ("\\\\10.0.0.1\\Other", 11)]
+    groups = engine.group_fan_out_destinations(destinations)
+    assert sorted(machine_num for group in groups for _, machine_num in group) == list(range(1, 12))
+    for group in groups:
+        hosts = [engine.get_destination_host(dest_dir) for dest_dir, _ in group]
+        assert len(group) <= engine.MIN_CONCURRENT_TRANSFERS
+        assert len({engine.get_host_subnet(host) for host in hosts}) == len(hosts)
+        monkeypatch.setattr(engine, "transfer_slot_state", slot_state(limit=engine.MIN_CONCURRENT_TRANSFERS))
+        assert engine.can_start_transfer(hosts)
+
+
+def test_scheduler_allows_one_transfer_per_host(monkeypatch):
+    monkeypatch.setattr(engine, "transfer_slot_state", slot_state(active=1, hosts={"10.0.0.1": 1}))
+    assert not engine.can_start_transfer(["10.0.0.1"])
+    assert engine.can_start_transfer(["10.0.0.2"])
+
+
+def test_scheduler_respects_global_and_subnet_limits(monkeypatch):
+    monkeypatch.setattr(engine, "MAX_TRANSFERS_PER_SUBNET", 2)
+    monkeypatch.setattr(engine, "transfer_slot_state", slot_state(active=2, hosts={"10.0.0.1": 1, "10.0.0.2": 1}))
+    assert not engine.can_start_transfer(["10.0.0.3"])
+    assert engine.can_start_transfer(["10.0.1.3"])
+    assert not engine.can_start_transfer(["10.0.1.3", "10.0.1.4", "10.0.1.5"])
+
+
+# ---- Resumable transfers ----
+
+def interrupt_copy(monkeypatch, machines, job_file, tmp_path):
+    monkeypatch.setattr(engine, "TRANSFER_CHUNK_SIZE", 64 * 1024)
+    monkeypatch.setattr(engine, "CHECKPOINT_SAVE_BYTES", 128 * 1024)
+    monkeypatch.setattr(engine, "CHECKPOINT_SAVE_SECONDS", 60.0)
+    machines(1)
+    src_path = job_file("a.bin", 1024 * 1024)
+    dest_dir = tmp_path / "machine-1"
+    monkeypatch.setattr(engine, "open_destination_file", make_failing_opener(dest_dir, 600 * 1024))
+    engine.copy_file(src_path, dest_dir, 1, {})
+    monkeypatch.setattr(engine, "open_destination_file", open)
+    return src_path, dest_dir
+
+
+def test_checkpoint_keeps_only_the_chunks_it_verifies(monkeypatch, machines, job_file, tmp_path):
+    src_path, dest_dir = interrupt_copy(monkeypatch, machines, job_file, tmp_path)
+    with open(engine.get_checkpoint_path(1, src_path), "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    # Saved every 128 KiB, so the last save before the failure confirmed 512 KiB
+    assert checkpoint["confirmed"] == 512 * 1024
+    assert len(checkpoint["chunks"]) == engine.CHECKPOINT_VERIFY_CHUNKS
+    assert checkpoint["first_chunk"] == 8 - engine.CHECKPOINT_VERIFY_CHUNKS
+    assert not (dest_dir / "a.bin").exists()
+
+
+def test_interrupted_copy_resumes_from_its_checkpoint(monkeypatch, machines, job_file, tmp_path, caplog):
+    src_path, dest_dir = interrupt_copy(monkeypatch, machines, job_file, tmp_path)
+    with caplog.at_level(logging.INFO):
+        engine.copy_file(src_path, dest_dir, 1, {})
+    assert f"at byte {512 * 1024}" in caplog.text
+    assert (dest_dir / "a.bin").read_bytes() == (tmp_path / "a.bin").read_bytes()
+    assert not engine.get_checkpoint_path(1, src_path).exists()
+    assert not (dest_dir / "a.bin.part").exists()
+
+
+def test_resume_falls_back_past_a_corrupted_chunk(monkeypatch, machines, job_file, tmp_path):
+    src_path, dest_dir = interrupt_copy(monkeypatch, machines, job_file, tmp_path)
+    temp_path = dest_dir / "a.bin.part"
+    with open(temp_path, "r+b") as f:
+        f.seek(500 * 1024)  # Inside the last confirmed chunk, 448-512 KiB
+        f.write(b"\0" * 16)
+    checkpoint = engine.load_checkpoint(engine.get_checkpoint_path(1, src_path), src_path, temp_path)
+    assert engine.verify_checkpoint(checkpoint, temp_path) == 448 * 1024
+
+
+# ---- Fan-out ----
+
+def test_fan_out_prepares_destinations_at_the_same_time(monkeypatch, machines, job_file, tmp_path):
+    machines(2)
+    src_path = job_file("a.bin", 300 * 1024)
+    # Each open waits for the other, so opening them one after another breaks the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    open_destination = engine.open_destination
+
+    def open_together(*args, **kwargs):
+        barrier.wait()
+        return open_destination(*args, **kwargs)
+    monkeypatch.setattr(engine, "open_destination", open_together)
+    engine.fan_out_copy(src_path, [(tmp_path / "machine-1", 1), (tmp_path / "machine-2", 2)], {})
+    assert not engine.fileErrors
+    for machine_num in (1, 2):
+        assert (tmp_path / f"machine-{machine_num}" / "a.bin").read_bytes() == (tmp_path / "a.bin").read_bytes()
+
+
+def test_fan_out_cleans_destinations_at_the_same_time(monkeypatch, machines, job_file, tmp_path):
+    machines(2)
+    src_path = job_file("a.bin", 300 * 1024)
+    for machine_num in (1, 2):
+        (tmp_path / f"machine-{machine_num}" / "old.bin").write_bytes(b"old job")
+    barrier = threading.Barrier(2, timeout=5)
+    delete_bin_files_on_machine = engine.delete_bin_files_on_machine
+
+    def delete_together(*args, **kwargs):
+        barrier.wait()
+        return delete_bin_files_on_machine(*args, **kwargs)
+    monkeypatch.setattr(engine, "delete_bin_files_on_machine", delete_together)
+    engine.fan_out_copy(src_path, [(tmp_path / "machine-1", 1), (tmp_path / "machine-2", 2)], {}, cleanup_first=True)
+    assert not engine.fileErrors
+    for machine_num in (1, 2):
+        assert sorted(os.listdir(tmp_path / f"machine-{machine_num}")) == ["a.bin"]
+
+
+def test_fan_out_only_writes_destinations_that_need_the_file(machines, job_file, tmp_path):
+    machines(2)
+    src_path = job_file("a.bin", 300 * 1024)
+    destinations = [(tmp_path / "machine-1", 1), (tmp_path / "machine-2", 2)]
+    engine.fan_out_copy(src_path, destinations, {})
+    os.remove(tmp_path / "machine-2" / "a.bin")
+    progress_slots = {}
+    engine.fan_out_copy(src_path, destinations, progress_slots)
+    assert progress_slots == {1: 1.0, 2: 1.0}
+    assert (tmp_path / "machine-2" / "a.bin").read_bytes() == (tmp_path / "a.bin").read_bytes()
+
+
+# ---- Retries and telemetry ----
+
+def test_retry_keeps_timings_from_the_first_attempt(monkeypatch, machines, job_file, tmp_path):
+    monkeypatch.setattr(engine, "TRANSFER_CHUNK_SIZE", 256 * 1024)
+    machines(2)
+    files = [job_file("a.bin", 1024 * 1024), job_file("b.bin", 1024 * 1024)]
+    # Machine 1's second chunk fails once, after its first byte was already recorded
+    monkeypatch.setattr(engine, "open_destination_file", make_failing_opener(tmp_path / "machine-1", 256 * 1024))
+    record = engine.stage_files(engine.assign_files(files, [1, 2]), progress_interval=0.05)
+
+    retried = record["machines"][0]
+    assert retried["status"] == "completed"
+    assert retried["attempts"] == 2
+    assert retried["ttfb_ms"] >= 0
+    assert retried["ttfb_ms"] / 1000 <= retried["duration_s"] <= retried["finished_after_s"] <= record["duration_s"]
+    assert retried["sent_bytes"] >= 1024 * 1024
+    assert (tmp_path / "machine-1" / "a.bin").read_bytes() == (tmp_path / "a.bin").read_bytes()
+
+
+def test_telemetry_sizes_queued_machines_up_front(job_file):
+    mb = 1024 * 1024
+    files = [job_file("a.bin", mb), job_file("b.bin", 2 * mb), job_file("c.bin", mb // 2)]
+    telemetry = engine.start_transfer_telemetry([(1, files[0]), (2, files[2]), (1, files[1])])
+    assert telemetry["machines"][1]["total"] == 3 * mb
+    assert telemetry["machines"][2]["total"] == mb // 2
+    assert "3.5 MB left" in engine.describe_run_telemetry(telemetry)
+
+
+def test_queued_machines_get_an_eta_from_machines_already_sending(job_file):
+    mb = 1024 * 1024
+    files = [job_file("a.bin", 4 * mb), job_file("b.bin", 2 * mb)]
+    telemetry = engine.start_transfer_telemetry([(1, files[0]), (2, files[1])])
+    with engine.telemetry_lock:
+        telemetry["machines"][1].update(status="transferring", copied=2 * mb, sent=2 * mb, avg_rate=float(mb))
+    queued = telemetry["machines"][2]
+    assert engine.get_machine_eta(queued) is None
+    assert engine.get_machine_eta(queued, float(mb)) == pytest.approx(2.0)
+    assert "ETA --:--" not in engine.describe_run_telemetry(telemetry)
+
+
+# ---- Pre-flight and compression ----
+
+def test_preflight_keeps_partial_compressed_files(monkeypatch, machines, tmp_path):
+    machines(1, m1={"compression": "gzip"})
+    src_path = tmp_path / "a.bin"
+    src_path.write_bytes(b"a" * (512 * 1024))
+    dest_dir = tmp_path / "machine-1"
+    (dest_dir / "a.bin.gz.part").write_bytes(b"partial")
+    (dest_dir / "old.bin.part").write_bytes(b"stale")
+    copies = []
+    monkeypatch.setattr(engine, "copy_file", lambda src, dest, machine_num, progress_slots:
+                        copies.append((src, sorted(os.listdir(dest)))))
+
+    engine.run_transfer_pass([(1, str(src_path))], {})
+    (sent_path, listing), = copies
+    assert sent_path.endswith("a.bin.gz")
+    assert "a.bin.gz.part" in listing
+    assert "old.bin.part" not in listing
+
+
+def test_preflight_counts_files_the_cleanup_will_delete_as_free(monkeypatch, machines, job_file, tmp_path):
+    machines(1)
+    src_path = job_file("a.bin", 4000)
+    (tmp_path / "machine-1" / "old.bin").write_bytes(b"x" * 8000)
+    monkeypatch.setattr(engine.shutil, "disk_usage", lambda path: SimpleNamespace(total=10000, used=9000, free=1000))
+    monkeypatch.setattr(engine, "PREFLIGHT_SLOW_WRITE_MS", float("inf"))
+
+    assert engine.run_preflight_checks({1: [src_path]}, {}) == {}
+    assert engine.run_preflight_checks({1: [src_path]}, {}, cleanup_first=True) == {1: [src_path]}
+
+
+def test_preflight_abandons_a_hanging_share_without_blocking_exit(monkeypatch, machines, job_file):
+    machines(1)
+    src_path = job_file("a.bin", 1000)
+    release = threading.Event()
+    monkeypatch.setattr(engine, "PREFLIGHT_TIMEOUT", 0.2)
+    monkeypatch.setattr(engine, "check_destination_share", lambda *args: release.wait())
+    try:
+        progress_slots = {}
+        assert engine.run_preflight_checks({1: [src_path]}, progress_slots) == {}
+        assert progress_slots == {1: -1}
+        hanging = [thread for thread in threading.enumerate()
+                   if thread.is_alive() and not thread.daemon and thread is not threading.main_thread()]
+        assert hanging == []
+    finally:
+        release.set()